@@ -0,0 +1,110 @@
+"""
+Concurrency benchmark for the database layer.
+
+Runs several processes against one security database, the way gunicorn workers do, each mixing permission checks with
+logins (which write a session), and reports throughput and errors for each storage configuration.
+
+    python bench/db_concurrency.py --workers 9 --seconds 5
+"""
+from datetime import datetime
+import multiprocessing
+import tempfile
+import argparse
+import sqlite3
+import random
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from telekinesis.Gatekeeper import Gatekeeper  # noqa: E402
+
+
+# (name, storage options, whether to reconnect for every operation as the database layer used to)
+configs = [
+    ('unpooled, rollback', {'journal_mode': 'delete', 'synchronous': 'full', 'busy_retries': 0}, True),
+    ('rollback journal', {'journal_mode': 'delete', 'synchronous': 'full'}, False),
+    ('wal', {'journal_mode': 'wal', 'synchronous': 'normal'}, False),
+    ('wal, single writer', {'journal_mode': 'wal', 'synchronous': 'normal', 'single_writer': True}, False),
+]
+
+users = ['user{}'.format(i) for i in range(50)]
+permissions = ['script.execute.{}'.format(i) for i in range(20)]
+
+
+def setup(db_location: str, storage: dict):
+    auth = Gatekeeper(db_location, storage=storage)
+    for permission in permissions:
+        auth.create_permission(permission)
+    for user in users:
+        auth.create_user(user, '')
+        for permission in random.sample(permissions, 5):
+            auth.apply_permission(user, permission)
+    auth.close()
+
+
+def worker(db_location: str, storage: dict, reconnect: bool, seconds: float, write_ratio: float, results):
+    # No auth cache, so every check goes to the database
+    auth = Gatekeeper(db_location, cache_ttl=0, storage=storage)
+    tokens = [auth.create_session(user, datetime(year=9000, month=1, day=1)) for user in random.sample(users, 5)]
+
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < write_ratio:
+                tokens[random.randrange(len(tokens))] = auth.create_session(
+                    random.choice(users), datetime(year=9000, month=1, day=1))
+                writes += 1
+            else:
+                auth.check_permission(random.choice(tokens), random.choice(permissions))
+                reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+        if reconnect:
+            auth.close()
+
+    results.put((reads, writes, errors))
+
+
+def run(name: str, storage: dict, reconnect: bool, workers: int, seconds: float, write_ratio: float,
+        parent_dir: str = None):
+    data_dir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        db_location = os.path.join(data_dir, 'security.db')
+        setup(db_location, storage)
+
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=worker, args=(db_location, storage, reconnect, seconds, write_ratio, results))
+            for _ in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        totals = [sum(col) for col in zip(*[results.get() for _ in procs])]
+        for proc in procs:
+            proc.join()
+    finally:
+        shutil.rmtree(data_dir)
+
+    reads, writes, errors = totals
+    print('{:<20} {:>10.0f} {:>10.0f} {:>10.0f} {:>8}'.format(
+        name, (reads + writes) / seconds, reads / seconds, writes / seconds, errors))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the databases under concurrent workers')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='Fraction of operations that are logins')
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Where to put the database; use the real data disk, as /tmp is often in memory')
+    args = parser.parse_args()
+
+    print('{} workers, {}s each, {:.0%} writes'.format(args.workers, args.seconds, args.write_ratio))
+    print('{:<20} {:>10} {:>10} {:>10} {:>8}'.format('config', 'ops/s', 'reads/s', 'writes/s', 'errors'))
+    for name, storage, reconnect in configs:
+        run(name, storage, reconnect, args.workers, args.seconds, args.write_ratio, args.data_dir)
@@ -0,0 +1,100 @@
+"""
+Login benchmark for the password hashers.
+
+Runs several processes logging in at once against one security database, the way gunicorn workers do, and reports
+logins per second and latency for each hasher and cost. The hash pool caps how many hashes run at once across all of
+them, which is what keeps the rest of the machine free to run scripts.
+
+    python bench/login.py --workers 9 --seconds 5 --hash-workers 2
+"""
+import multiprocessing
+import statistics
+import tempfile
+import argparse
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from telekinesis.Gatekeeper import Gatekeeper, GatekeeperBusy, make_hasher  # noqa: E402
+
+
+# (name, hasher options)
+configs = [
+    ('sha512 (old)', {'name': 'sha512'}),
+    ('scrypt n=4096', {'name': 'scrypt', 'scrypt_n': 4096}),
+    ('scrypt n=16384', {'name': 'scrypt', 'scrypt_n': 16384}),
+    ('scrypt n=65536', {'name': 'scrypt', 'scrypt_n': 65536}),
+]
+
+users = ['user{}'.format(i) for i in range(20)]
+
+
+def setup(db_location: str, hashing: dict):
+    auth = Gatekeeper(db_location, hasher=make_hasher(**hashing))
+    for user in users:
+        auth.create_user(user, 'password-' + user)
+    auth.close()
+
+
+def worker(db_location: str, hashing: dict, hash_workers: int, seconds: float, results):
+    auth = Gatekeeper(db_location, hasher=make_hasher(**hashing), hash_workers=hash_workers)
+
+    latencies = []
+    busy = 0
+    i = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        user = users[i % len(users)]
+        i += 1
+        started = time.monotonic()
+        try:
+            assert auth.login(user, 'password-' + user)
+            latencies.append(time.monotonic() - started)
+        except GatekeeperBusy:
+            busy += 1
+
+    results.put((latencies, busy))
+
+
+def run(name: str, hashing: dict, workers: int, hash_workers: int, seconds: float, parent_dir: str = None):
+    data_dir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        db_location = os.path.join(data_dir, 'security.db')
+        setup(db_location, hashing)
+
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=worker, args=(db_location, hashing, hash_workers, seconds, results))
+            for _ in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        collected = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+    finally:
+        shutil.rmtree(data_dir)
+
+    latencies = sorted(latency for worker_latencies, _ in collected for latency in worker_latencies)
+    busy = sum(worker_busy for _, worker_busy in collected)
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    print('{:<16} {:>10.0f} {:>12.1f} {:>12.1f} {:>8}'.format(
+        name, len(latencies) / seconds, statistics.median(latencies or [0]) * 1000, p99 * 1000, busy))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark logins under concurrent workers')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--hash-workers', type=int, default=2, help='Most hashes at once across all workers')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Where to put the database; use the real data disk, as /tmp is often in memory')
+    args = parser.parse_args()
+
+    print('{} workers, {} hash workers, {}s each'.format(args.workers, args.hash_workers, args.seconds))
+    print('{:<16} {:>10} {:>12} {:>12} {:>8}'.format('hasher', 'logins/s', 'p50 ms', 'p99 ms', 'busy'))
+    for name, hashing in configs:
+        run(name, hashing, args.workers, args.hash_workers, args.seconds, args.data_dir)
@@ -0,0 +1,90 @@
+"""
+Search benchmark for the full-text index over scripts.
+
+Fills a database with templated scripts, much like real ones, then reports the latency of searches that match few,
+some and most of them, with and without limiting them to the scripts a user may read.
+
+    python bench/search.py --scripts 100000 --searches 200
+"""
+import statistics
+import tempfile
+import argparse
+import random
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from telekinesis import models  # noqa: E402
+from telekinesis.models import Script  # noqa: E402
+from telekinesis.utils import SqlConn  # noqa: E402
+
+
+services = ['nginx', 'postgres', 'redis', 'backup', 'worker', 'cron', 'mailer', 'queue', 'search', 'metrics']
+actions = ['restart', 'status', 'reload', 'stop', 'start']
+hosts = ['web{}'.format(i) for i in range(200)]
+words = ['disk', 'usage', 'check', 'rotate', 'logs', 'deploy', 'release', 'cache', 'flush', 'health', 'report',
+         'cleanup', 'tmp', 'certificates', 'renew', 'database', 'vacuum', 'snapshot', 'upload', 'sync']
+
+# (name, search text)
+searches = [
+    ('rare', 'web17 certificates'),
+    ('some', 'postgres vacuum'),
+    ('most', 'systemctl'),
+    ('prefix', 'cert* renew'),
+]
+
+
+def make_script(i: int) -> Script:
+    service, action, host = random.choice(services), random.choice(actions), random.choice(hosts)
+    description = '{} {} on {}: {}'.format(action, service, host, ' '.join(random.sample(words, 3)))
+    body = '#!/bin/sh\n# {}\nssh {} systemctl {} {}\ncurl -s http://{}:{}/health\n'.format(
+        i, host, action, service, host, 8000 + i % 100)
+    return Script(script=body, description=description, fork=False)
+
+
+def setup(conn: SqlConn, scripts: int):
+    with conn:
+        for i in range(scripts):
+            make_script(i).store()
+
+
+def run(name: str, text: str, searches: int, script_ids: list = None):
+    latencies = []
+    for _ in range(searches):
+        started = time.perf_counter()
+        results = Script.search(text, limit=20, script_ids=script_ids)
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    print('{:<20} {:>8} {:>10.2f} {:>10.2f}'.format(
+        name, len(results), statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark searching scripts')
+    parser.add_argument('--scripts', type=int, default=100000)
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--readable', type=int, default=500, help='How many scripts the restricted user may read')
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Where to put the database; use the real data disk, as /tmp is often in memory')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(dir=args.data_dir)
+    try:
+        conn = SqlConn(os.path.join(data_dir, 'telekinesis.db'))
+        models.setup(auth=None, conn=conn)
+
+        started = time.monotonic()
+        setup(conn, args.scripts)
+        print('{} scripts stored in {:.1f}s'.format(args.scripts, time.monotonic() - started))
+
+        readable = sorted(random.sample(range(1, args.scripts + 1), min(args.readable, args.scripts)))
+        print('{:<20} {:>8} {:>10} {:>10}'.format('search', 'results', 'p50 ms', 'p99 ms'))
+        for name, text in searches:
+            run(name, text, args.searches)
+            run(name + ', readable', text, args.searches, readable)
+    finally:
+        shutil.rmtree(data_dir)
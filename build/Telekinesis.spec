@@ -15,6 +15,9 @@ a = Analysis([docroot + '/src/run.py'],
                 (docroot + '/src/telekinesis/swaggerfile.json', 'telekinesis'),
                 (docroot + '/src/telekinesis/Gatekeeper/gatekeeper.sql', 'telekinesis/Gatekeeper'),
                 (docroot + '/src/telekinesis/models/script.sql', 'telekinesis/models'),
+                (docroot + '/src/telekinesis/models/job.sql', 'telekinesis/models'),
+                (docroot + '/src/telekinesis/models/result.sql', 'telekinesis/models'),
+                (docroot + '/src/telekinesis/models/revision.sql', 'telekinesis/models'),
                 (docroot + '/src/telekinesis/models/create_db.sql', 'telekinesis/models'),
              ],
              hiddenimports=[
@@ -1,4 +1,4 @@
-from telekinesis import Telekinesis, initialize
+from telekinesis import Telekinesis, initialize, start_worker, sweep_once
 
 import multiprocessing
 import gunicorn.app.base
@@ -50,16 +50,46 @@ def get_config(parser):
         'data_dir': '.',
         'port': '80',
         'ssh': '',
+        'ssh_persist': '300',
         'run_as_user': '',
         'run_as_password': '',
+        'max_running': '64',
+        'max_running_script': '0',
+        'max_running_user': '0',
+        'max_queued': '64',
+        'queue_timeout': '10',
+        'output_limit': '1048576',
+        'output_spill_limit': '104857600',
+        'default_timeout': '10',
+        'kill_grace': '5',
+        'worker_timeout': '120',
+        'cache_entries': '1000',
+        'auth_cache_ttl': '5',
+        'auth_cache_entries': '10000',
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': '5000',
+        'single_writer': 'false',
+        'unified_storage': 'false',
+        'signed_sessions': 'false',
+        'password_hasher': 'scrypt',
+        'scrypt_n': '16384',
+        'scrypt_r': '8',
+        'scrypt_p': '1',
+        'hash_workers': '2',
+        'sweep_interval': '3600',
+        'sweep_batch_size': '1000',
+        'job_retention': '604800',
+        'vacuum': 'false',
     }
 
     data = {}
 
     for field in defaults.keys():
-        if field in cl_args and cl_args[field]:  # Take from command line first priority
+        # Checked against None / '' rather than for truth, so that 0 and false are valid settings
+        if field in cl_args and cl_args[field] not in (None, ''):  # Take from command line first priority
             data[field] = cl_args[field]
-        elif field in f_args and f_args[field]:  # Next try the config file
+        elif field in f_args and f_args[field] not in (None, ''):  # Next try the config file
             data[field] = f_args[field]
         elif defaults[field] is not None:  # If defaults is not None, take the default
             data[field] = defaults[field]
@@ -77,14 +107,39 @@ if __name__ == '__main__':
     parser.add_argument('--data-dir', type=str, help='Storage for Telekinesis logs', default='')
     parser.add_argument('--port', type=str, help='Storage for Telekinesis logs', default='')
     parser.add_argument('--ssh', type=str, help='Params to SSH into a target before executing a script', default='')
+    parser.add_argument('--ssh-persist', type=str, help='Seconds to keep an idle SSH connection open for reuse (0 to disable)', default='')
+    parser.add_argument('--max-running', type=str, help='Most scripts allowed to run at once across all workers (0 for no limit)', default='')
+    parser.add_argument('--max-running-script', type=str, help='Most concurrent runs of any one script (0 for no limit)', default='')
+    parser.add_argument('--max-running-user', type=str, help='Most concurrent runs by any one user (0 for no limit)', default='')
+    parser.add_argument('--max-queued', type=str, help='Most executions allowed to wait for a free slot before returning 429', default='')
+    parser.add_argument('--queue-timeout', type=str, help='Seconds an execution may wait for a free slot before returning 429', default='')
+    parser.add_argument('--output-limit', type=str, help='Bytes of stdout / stderr to return inline; the rest is written to disk', default='')
+    parser.add_argument('--output-spill-limit', type=str, help='Most bytes of stdout / stderr to keep on disk per execution', default='')
+    parser.add_argument('--default-timeout', type=str, help='Seconds a script may run if it does not set its own timeout', default='')
+    parser.add_argument('--kill-grace', type=str, help='Seconds between SIGTERM and SIGKILL for a script that timed out', default='')
+    parser.add_argument('--worker-timeout', type=str, help='Seconds a request may take before its worker is restarted', default='')
+    parser.add_argument('--cache-entries', type=str, help='Most script results kept for cacheable scripts', default='')
+    parser.add_argument('--auth-cache-ttl', type=str, help='Seconds a worker may cache a session or permission lookup (0 to disable)', default='')
+    parser.add_argument('--auth-cache-entries', type=str, help='Most sessions / users whose permissions each worker keeps cached', default='')
+    parser.add_argument('--journal-mode', type=str, help='SQLite journal mode for the databases (wal, delete, truncate, persist)', default='')
+    parser.add_argument('--synchronous', type=str, help='SQLite synchronous level (off, normal, full, extra)', default='')
+    parser.add_argument('--busy-timeout', type=str, help='Milliseconds to wait on a locked database before retrying', default='')
+    parser.add_argument('--single-writer', type=str, help='Queue database writes from all workers through a lock file (true / false)', default='')
+    parser.add_argument('--unified-storage', type=str, help='Keep security data in telekinesis.db, so each request is one transaction (true / false)', default='')
+    parser.add_argument('--signed-sessions', type=str, help='Issue signed session tokens that are checked without a database lookup (true / false)', default='')
+    parser.add_argument('--password-hasher', type=str, help='How to hash new passwords (scrypt / sha512)', default='')
+    parser.add_argument('--scrypt-n', type=str, help='scrypt CPU / memory cost, a power of 2', default='')
+    parser.add_argument('--scrypt-r', type=str, help='scrypt block size', default='')
+    parser.add_argument('--scrypt-p', type=str, help='scrypt parallelism', default='')
+    parser.add_argument('--hash-workers', type=str, help='Most passwords hashed at once across all workers', default='')
+    parser.add_argument('--sweep-interval', type=str, help='Seconds between maintenance runs in the server (0 to disable)', default='')
+    parser.add_argument('--sweep-batch-size', type=str, help='Most rows maintenance deletes per transaction', default='')
+    parser.add_argument('--job-retention', type=str, help='Seconds to keep finished jobs and their output', default='')
+    parser.add_argument('--vacuum', type=str, help='VACUUM the databases during maintenance (true / false)', default='')
+    parser.add_argument('--sweep', action='store_true', help='Run maintenance once and exit, instead of serving')
     parser.add_argument('-c', '--config', type=str, help='Use config file for telekinesis setup. Command line arguments take priority.', default='')
     args = get_config(parser)
 
-    if not (args['ssh'] or (args['run_as_user'] and args['run_as_password'])):
-        print('Telekinesis will execute scripts as the current user. This is potentially unsafe -- they will be able '
-              'to access local files and edit the permissions database. It is recommended to run as an unprivileged '
-              'user, or to change the execution environment (e.g. to a container) via SSH')
-
     logging.basicConfig(
         filename=os.path.join(args['log_dir'], 'telekinesis.log'),
         level=logging.DEBUG,
@@ -92,6 +147,36 @@ if __name__ == '__main__':
         datefmt='%Y-%m-%d %H:%M:%S',
     )
 
+    storage = {
+        'journal_mode': args['journal_mode'],
+        'synchronous': args['synchronous'],
+        'busy_timeout': args['busy_timeout'],
+        'single_writer': str(args['single_writer']).lower() in ('true', 'yes', '1'),
+    }
+    unified_storage = str(args['unified_storage']).lower() in ('true', 'yes', '1')
+    maintenance_settings = {
+        'interval': args['sweep_interval'],
+        'batch_size': args['sweep_batch_size'],
+        'job_retention': args['job_retention'],
+        'vacuum': str(args['vacuum']).lower() in ('true', 'yes', '1'),
+    }
+
+    if parser.parse_args().sweep:
+        counts = sweep_once(args['data_dir'], storage=storage, unified_storage=unified_storage, **maintenance_settings)
+        print(json.dumps(counts))
+        exit(0)
+
+    # A sync or streamed execution keeps its worker busy while it queues, runs and is killed, and gunicorn restarts
+    # workers that are busy for longer than the worker timeout (orphaning the script); longer ones must run async
+    sync_limit = int(args['worker_timeout']) - int(args['queue_timeout']) - int(args['kill_grace']) - 10
+    if sync_limit < 1:
+        parser.error('worker_timeout must be more than queue_timeout + kill_grace + 10')
+
+    if not (args['ssh'] or (args['run_as_user'] and args['run_as_password'])):
+        print('Telekinesis will execute scripts as the current user. This is potentially unsafe -- they will be able '
+              'to access local files and edit the permissions database. It is recommended to run as an unprivileged '
+              'user, or to change the execution environment (e.g. to a container) via SSH')
+
     initialize(
         admin_username=args['admin'],
         admin_password=args['password'],
@@ -99,13 +184,48 @@ if __name__ == '__main__':
         security={
             'security_type': 'ssh' if args['ssh'] else 'user' if (args['run_as_user'] and args['run_as_password']) else 'none',
             'ssh_args': args['ssh'],
+            'ssh_persist': args['ssh_persist'],
             'username': args['run_as_user'],
             'password': args['run_as_password'],
         },
+        limits={
+            'max_running': args['max_running'],
+            'max_running_script': args['max_running_script'],
+            'max_running_user': args['max_running_user'],
+            'max_queued': args['max_queued'],
+            'queue_timeout': args['queue_timeout'],
+        },
+        output_limits={
+            'output_limit': args['output_limit'],
+            'output_spill_limit': args['output_spill_limit'],
+        },
+        timeouts={
+            'default_timeout': args['default_timeout'],
+            'kill_grace': args['kill_grace'],
+            'sync_limit': sync_limit,
+        },
+        cache_entries=args['cache_entries'],
+        auth_cache={
+            'cache_ttl': args['auth_cache_ttl'],
+            'cache_entries': args['auth_cache_entries'],
+        },
+        storage=storage,
+        maintenance_settings=maintenance_settings,
+        unified_storage=unified_storage,
+        signed_sessions=str(args['signed_sessions']).lower() in ('true', 'yes', '1'),
+        password_hashing={
+            'name': args['password_hasher'],
+            'scrypt_n': int(args['scrypt_n']),
+            'scrypt_r': int(args['scrypt_r']),
+            'scrypt_p': int(args['scrypt_p']),
+            'hash_workers': args['hash_workers'],
+        },
     )
 
     options = {
         'bind': '%s:%s' % ('0.0.0.0', args['port']),
         'workers': number_of_workers(),
+        'timeout': int(args['worker_timeout']),
+        'post_fork': lambda server, worker: start_worker(),
     }
     StandaloneApplication(Telekinesis, options).run()
@@ -1,12 +1,16 @@
 import os
 from datetime import datetime
-from hashlib import sha512
+import binascii
 import base64
+import hmac
+import json
 import uuid
 import sqlite3
 import logging
 
-from .utils import load_sql, SqlConn
+from .utils import load_sql, SqlConn, migrate
+from .cache import LruCache, Generation
+from .hasher import ScryptHasher, Sha512Hasher, HashPool
 
 root_name = os.path.dirname(__file__)
 sql = load_sql(os.path.join(root_name, 'gatekeeper.sql'))
@@ -14,6 +18,90 @@ sql = load_sql(os.path.join(root_name, 'gatekeeper.sql'))
 
 logger = logging.getLogger(__name__)
 
+_missing = object()
+
+
+def _migrate_1(cur):
+    # The original schema, which databases made before migrations existed already have
+    cur.execute(sql['create_users'])
+    cur.execute(sql['create_sessions'])
+    cur.execute(sql['create_permission_types'])
+    cur.execute(sql['create_permissions'])
+
+
+def _migrate_2(cur):
+    # Session lookups and expiry by user / date, and cascading deletes of permission types
+    cur.execute(sql['create_sessions_uname_index'])
+    cur.execute(sql['create_sessions_expires_index'])
+    cur.execute(sql['create_permissions_ptype_index'])
+
+
+def _migrate_3(cur):
+    # A revocation epoch per user, which signed session tokens must match
+    cur.execute(sql['add_users_epoch'])
+
+
+def _migrate_4(cur):
+    # Roles: users can be members of other users, and hold everything those hold
+    cur.execute(sql['create_memberships'])
+    cur.execute(sql['create_memberships_role_index'])
+
+
+_migrations = [_migrate_1, _migrate_2, _migrate_3, _migrate_4]
+
+
+def load_secret(path: str) -> bytes:
+    # The key signed session tokens are made with, shared by every worker through a file next to the databases. It is
+    # made on first use; deleting it ends every signed session.
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'wb') as key_f:
+            key_f.write(os.urandom(32))
+
+    with open(path, 'rb') as key_f:
+        secret = key_f.read()
+    if len(secret) < 32:
+        raise GatekeeperException('Session key {} is too short'.format(path))
+    return secret
+
+
+def merge_database(source_location: str, conn: SqlConn, storage: dict = None) -> bool:
+    # Moves a standalone security database into the database behind `conn`, in one transaction, and renames the old
+    # file out of the way. Returns whether there was anything to merge.
+    if not os.path.isfile(source_location):
+        return False
+
+    with conn as cur:
+        cur.execute(sql['get_users_table'])
+        merged = cur.fetchone()
+    if merged:
+        logger.warning('{} already has security tables, not merging {} into it'.format(
+            conn.db_location, source_location))
+        return False
+
+    logger.info('Merging {} into {}'.format(source_location, conn.db_location))
+    # Bring it up to the same schema first, so the tables match column for column
+    source = Gatekeeper(source_location, cache_ttl=0, storage=storage)
+    source.close()
+
+    conn.autocommit(sql['attach_legacy'], (source_location,))
+    try:
+        with conn as cur:
+            migrate(conn, _migrations, 'gatekeeper')
+            for table in ['users', 'permission_types', 'permissions', 'memberships', 'sessions']:
+                cur.execute(sql['merge_{}'.format(table)])
+    finally:
+        conn.autocommit(sql['detach_legacy'])
+
+    # Its -wal / -shm files, if another process still had it open, go along with it
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.isfile(source_location + suffix):
+            os.rename(source_location + suffix, source_location + '.merged' + suffix)
+    return True
+
 
 class GatekeeperException(Exception):
     def __init__(self, msg):
@@ -21,35 +109,227 @@ class GatekeeperException(Exception):
         super().__init__(msg)
 
 
+class GatekeeperBusy(GatekeeperException):
+    # Too many passwords are being hashed at once; worth trying again shortly
+    pass
+
+
 class Gatekeeper:
-    def __init__(self, db_location: str):
+    def __init__(self, db_location: str, cache_ttl: float = 5, cache_entries: int = 10000, storage: dict = None,
+                 conn: SqlConn = None, secret: bytes = None, hasher=None, hash_workers: int = 2,
+                 hash_timeout: float = 10):
+        # Given `conn`, the security tables live in that (shared) database, and its transactions cover ours.
+        # Given `secret`, new sessions are signed tokens that are checked without looking them up (see _sign_session).
         self.db_location = db_location
+        self._secret = secret
+
+        # Passwords are hashed with `hasher`, on a pool that runs at most `hash_workers` hashes at once across every
+        # process using this database. Hashes made by older hashers, or with other costs, are still checked, and
+        # replaced on the next login.
+        self._hasher = hasher if hasher is not None else ScryptHasher()
+        self._verifiers = [self._hasher, ScryptHasher(), Sha512Hasher()]
+        self._hash_pool = HashPool(hash_workers, db_location + '.hash', hash_timeout)
+        self._conn = conn if conn is not None else SqlConn(db_location, **(storage or {}))
+
+        # Sessions and the permissions of each user are cached in-process for up to `cache_ttl` seconds. Anything that
+        # changes them bumps the generation, which clears the caches in every process using this database.
+        self._sessions = LruCache(int(cache_entries), float(cache_ttl))
+        self._user_permissions = LruCache(int(cache_entries), float(cache_ttl))
+        self._user_epochs = LruCache(int(cache_entries), float(cache_ttl))
+        self._generation = Generation(db_location + '.gen')
+        self._seen_generation = self._generation.current()
 
         dirname = os.path.dirname(db_location)
         if not os.path.isdir(dirname):
             raise GatekeeperException('Path to directory: {} does not exist'.format(dirname))
 
-        if not os.path.isfile(db_location):
-            self._create_database()
-
-
-    def _create_database(self):
         try:
-            with SqlConn(self.db_location) as cur:
-                cur.execute(sql['create_users'])
-                cur.execute(sql['create_sessions'])
-                cur.execute(sql['create_permission_types'])
-                cur.execute(sql['create_permissions'])
+            # A database of our own may be from before components were tracked by name; a shared one is not ours
+            migrate(self._conn, _migrations, 'gatekeeper', legacy_component='gatekeeper' if conn is None else None)
         except Exception as e:
-            raise GatekeeperException('Could not create database: {}'.format(str(e)))
+            raise GatekeeperException('Could not create or migrate database: {}'.format(str(e)))
+
+
+    def close(self):
+        # Closes this thread's database connection; it is reopened on next use
+        self._conn.close()
+
+
+    def _check_generation(self):
+        # Returns the current generation, so lookups can skip caching results that were read while it changed
+        generation = self._generation.current()
+        if generation != self._seen_generation:
+            self._sessions.clear()
+            self._user_permissions.clear()
+            self._user_epochs.clear()
+            self._seen_generation = generation
+        return generation
+
+
+    def _invalidate(self):
+        # Only once the change is committed, never before -- otherwise another process could cache the old state again
+        self._conn.after_transaction(self._clear_caches)
+
+
+    def _clear_caches(self):
+        self._generation.bump()
+        self._sessions.clear()
+        self._user_permissions.clear()
+        self._user_epochs.clear()
+
+
+    def _get_session(self, session: str):
+        generation = self._check_generation()
+        cached = self._sessions.get(session, _missing)
+        if cached is not _missing:
+            return cached
+
+        with self._conn as cur:
+            cur.execute(sql['get_session'], (session,))
+            results = cur.fetchone()
+
+        entry = tuple(results) if results else None
+        if self._generation.current() == generation:
+            self._sessions.put(session, entry)
+        return entry
+
+
+    def _get_user_permissions(self, user: str) -> frozenset:
+        generation = self._check_generation()
+        cached = self._user_permissions.get(user)
+        if cached is not None:
+            return cached
+
+        with self._conn as cur:
+            cur.execute(sql['get_effective_permissions'], (user,))
+            rows = cur.fetchall()
+
+        permissions = frozenset(row[0] for row in rows)
+        if self._generation.current() == generation:
+            self._user_permissions.put(user, permissions)
+        return permissions
+
+
+    @staticmethod
+    def _holds(granted: frozenset, permission: str) -> bool:
+        # Exactly, or through a pattern: "script.execute.*", "script.*" and "*" all hold "script.execute.5". One set
+        # lookup per level of the name, however many grants there are.
+        if permission in granted:
+            return True
+
+        prefix = ''
+        for unit in permission.split('.'):
+            if prefix + '*' in granted:
+                return True
+            prefix += unit + '.'
+        return False
+
+
+    def _get_user_epoch(self, user: str) -> int:
+        generation = self._check_generation()
+        cached = self._user_epochs.get(user, _missing)
+        if cached is not _missing:
+            return cached
+
+        with self._conn as cur:
+            cur.execute(sql['get_user_epoch'], (user,))
+            results = cur.fetchone()
+
+        epoch = results[0] if results else None
+        if self._generation.current() == generation:
+            self._user_epochs.put(user, epoch)
+        return epoch
 
 
     @staticmethod
-    def _get_pass_hash(password: str, salt: bytes):
-        hasher = sha512()
-        hasher.update(password.encode('utf-8'))
-        hasher.update(salt)
-        return hasher.hexdigest()
+    def _new_epoch() -> int:
+        # Random rather than counted, so a user deleted and made again can't match tokens of the old one
+        return int.from_bytes(os.urandom(7), 'big')
+
+
+    def _sign_session(self, user: str, expiry: datetime, epoch: int) -> str:
+        # <payload>.<signature>, both base64url. The payload carries everything needed to check the token, so it
+        # isn't stored; revoking it means changing the user's epoch, which every token of theirs carries.
+        payload = json.dumps([user, expiry.isoformat(' '), epoch], separators=(',', ':')).encode('utf-8')
+        signature = hmac.digest(self._secret, payload, 'sha256')
+        return '{}.{}'.format(self._b64encode(payload), self._b64encode(signature))
+
+
+    @staticmethod
+    def _b64encode(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+    @staticmethod
+    def _b64decode(data: str) -> bytes:
+        return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+    def _signed_session_user(self, session: str, expiry: datetime) -> str:
+        # What a token says never changes, so checking its signature is cached along with stored sessions; whether it
+        # has been revoked is not, as that comes from the user's (cached) epoch
+        claims = self._sessions.get(session)
+        if claims is None:
+            claims = self._verify_session(session)
+            if claims is None:
+                return None
+            self._sessions.put(session, claims)
+
+        user, expires, epoch = claims
+        if not expires > expiry.isoformat(' '):
+            return None
+        if self._get_user_epoch(user) != epoch:
+            return None
+        return user
+
+
+    def _verify_session(self, session: str) -> tuple:
+        try:
+            payload_b64, signature_b64 = session.split('.')
+            payload = self._b64decode(payload_b64)
+            signature = self._b64decode(signature_b64)
+        except (ValueError, binascii.Error):
+            return None
+
+        if not hmac.compare_digest(signature, hmac.digest(self._secret, payload, 'sha256')):
+            return None
+        return tuple(json.loads(payload.decode('utf-8')))
+
+
+    def _session_user(self, session: str, expiry: datetime) -> str:
+        # Stored tokens are uuid4 hex, which never has a '.'
+        if self._secret is not None and '.' in session:
+            return self._signed_session_user(session, expiry)
+
+        entry = self._get_session(session)
+        if not entry:
+            return None
+
+        user, expires = entry
+        # Same comparison as the database makes: sqlite stores datetimes as ISO strings
+        if not expires > expiry.isoformat(' '):
+            return None
+        return user
+
+
+    def _run_hasher(self, fn, *args):
+        try:
+            return self._hash_pool.run(fn, *args)
+        except TimeoutError:
+            raise GatekeeperBusy('Too many passwords are being checked at once, try again shortly')
+
+
+    def _hash_password(self, password: str) -> (str, str):
+        # An empty password can never log in, so there is no point in spending a hash on it (public users are made
+        # with one for every script). '!' is not a hash any hasher makes.
+        if password == '':
+            return '!', ''
+        return self._run_hasher(self._hasher.hash, password)
+
+
+    def _user_row(self, user: str, password: str) -> tuple:
+        pass_hash, salt_b64 = self._hash_password(password)
+        return user, pass_hash, salt_b64, self._new_epoch()
 
 
     @staticmethod
@@ -98,13 +378,9 @@ class Gatekeeper:
         self._validate('user', user)
         self._validate_nomin('password', password)
 
-        salt = os.urandom(128)
-        salt_b64 = base64.b64encode(salt).decode('utf-8')
-        pass_hash = self._get_pass_hash(password, salt)
-
         try:
-            with SqlConn(self.db_location) as cur:
-                cur.execute(sql['create_user'], (user, pass_hash, salt_b64))
+            with self._conn as cur:
+                cur.execute(sql['create_user'], self._user_row(user, password))
         except sqlite3.IntegrityError as e:
             if e.args[0] == 'UNIQUE constraint failed: users.uname':
                 raise GatekeeperException('User already exists')
@@ -116,11 +392,9 @@ class Gatekeeper:
         self._validate('user', user)
         self._validate_nomin('password', password)
 
-        salt = os.urandom(128)
-        salt_b64 = base64.b64encode(salt).decode('utf-8')
-        pass_hash = self._get_pass_hash(password, salt)
+        pass_hash, salt_b64 = self._hash_password(password)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['change_password'], (pass_hash, salt_b64, user))
 
 
@@ -131,7 +405,7 @@ class Gatekeeper:
         if password == '':
             return False
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['get_pass_hash'], (user,))
             results = cur.fetchone()
 
@@ -139,26 +413,75 @@ class Gatekeeper:
             return False
 
         pass_hash, salt_b64 = results
-        salt = base64.b64decode(salt_b64)
+        verifier = next((verifier for verifier in self._verifiers if verifier.identifies(pass_hash)), None)
+        if verifier is None or not self._run_hasher(verifier.verify, password, pass_hash, salt_b64):
+            return False
+
+        if verifier is not self._hasher or self._hasher.needs_rehash(pass_hash):
+            self._rehash_password(user, password, pass_hash)
+        return True
+
+
+    def _rehash_password(self, user: str, password: str, old_pass_hash: str):
+        # Only the password just checked is replaced, in case it was changed in the meantime
+        try:
+            new_pass_hash, salt_b64 = self._hash_password(password)
+        except GatekeeperBusy:
+            return  # Next time, then
 
-        return pass_hash == self._get_pass_hash(password, salt)
+        with self._conn as cur:
+            cur.execute(sql['rehash_password'], (new_pass_hash, salt_b64, user, old_pass_hash))
+        logger.info('Rehashed the password of user {}'.format(user))
 
 
     def delete_user(self, user: str):
         self._validate('user', user)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['delete_user'], (user,))
+        self._invalidate()
+
+
+    def get_user_names(self, pattern: str = '%') -> list:
+        # `pattern` is matched with LIKE
+        self._validate('pattern', pattern)
+
+        with self._conn as cur:
+            cur.execute(sql['get_user_names'], (pattern,))
+            rows = cur.fetchall()
+
+        return [row[0] for row in rows]
+
+
+    def delete_users(self, users: list) -> int:
+        for user in users:
+            self._validate('user', user)
+
+        with self._conn as cur:
+            cur.execute(sql['delete_users'], (json.dumps(users),))
+            deleted = cur.rowcount
+        self._invalidate()
+
+        return deleted
 
 
     def create_session(self, user: str, expiry: datetime) -> str:
         self._validate('user', user)
         self._validate_expiry(expiry)
 
-        token = uuid.uuid4().hex
-        with SqlConn(self.db_location) as cur:
+        # Either way, logging in ends the user's other sessions
+        with self._conn as cur:
             cur.execute(sql['expire_sessions_user'], (user,))
-            cur.execute(sql['create_session'], (token, expiry, user))
+            if self._secret is not None:
+                epoch = self._new_epoch()
+                cur.execute(sql['set_user_epoch'], (epoch, user))
+                if cur.rowcount == 0:
+                    raise GatekeeperException('No such user')
+                token = self._sign_session(user, expiry, epoch)
+            else:
+                token = uuid.uuid4().hex
+                cur.execute(sql['create_session'], (token, expiry, user))
+        self._invalidate()
 
         return token
 
@@ -169,24 +492,51 @@ class Gatekeeper:
 
         self._validate_expiry(expiry)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['expire_sessions'], (expiry,))
+        self._invalidate()
+
+
+    def purge_expired_sessions(self, expiry: datetime = None, batch_size: int = 1000) -> int:
+        # Like expire_sessions_date, but a batch per transaction so other workers aren't locked out for the whole purge.
+        # Expired sessions are already refused, so the caches don't need clearing.
+        if not expiry:
+            expiry = datetime.now()
+
+        self._validate_expiry(expiry)
+
+        purged = 0
+        while True:
+            with self._conn as cur:
+                cur.execute(sql['purge_expired_sessions'], (expiry, batch_size))
+                deleted = cur.rowcount
+            purged += deleted
+            if deleted < batch_size:
+                return purged
 
 
     def expire_sessions_user(self, user: str):
         self._validate('user', user)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['expire_sessions_user'], (user,))
+            cur.execute(sql['set_user_epoch'], (self._new_epoch(), user))
+        self._invalidate()
 
 
     def apply_permission(self, user: str, permission: str):
         self._validate('user', user)
         self._validate('permission', permission)
 
+        with self._conn as cur:
+            self._apply_permission(cur, user, permission)
+        self._invalidate()
+
+
+    @staticmethod
+    def _apply_permission(cur: sqlite3.Cursor, user: str, permission: str):
         try:
-            with SqlConn(self.db_location) as cur:
-                cur.execute(sql['add_permission'], (user, permission))
+            cur.execute(sql['add_permission'], (user, permission))
         except sqlite3.IntegrityError as e:
             if e.args[0] == 'FOREIGN KEY constraint failed':
                 raise GatekeeperException('No such user')
@@ -198,10 +548,59 @@ class Gatekeeper:
                 raise e
 
 
+    def apply_permissions(self, grants: list):
+        # Bulk form of apply_permission, taking (user, permission) pairs. All of them are applied, or none are.
+        for user, permission in grants:
+            self._validate('user', user)
+            self._validate('permission', permission)
+
+        with self._conn as cur:
+            for user, permission in grants:
+                self._apply_permission(cur, user, permission)
+        self._invalidate()
+
+
+    def add_role(self, user: str, role: str):
+        # `user` gets every permission `role` (itself just a user) holds, now or later, including through its own roles
+        self._validate('user', user)
+        self._validate('role', role)
+
+        try:
+            with self._conn as cur:
+                cur.execute(sql['add_membership'], (user, role))
+        except sqlite3.IntegrityError as e:
+            if e.args[0] == 'FOREIGN KEY constraint failed':
+                raise GatekeeperException('No such user or role')
+            elif e.args[0] == 'UNIQUE constraint failed: memberships.uname, memberships.role':
+                pass  # Already a member
+            else:
+                raise e
+        self._invalidate()
+
+
+    def remove_role(self, user: str, role: str):
+        self._validate('user', user)
+        self._validate('role', role)
+
+        with self._conn as cur:
+            cur.execute(sql['remove_membership'], (user, role))
+        self._invalidate()
+
+
+    def get_roles(self, user: str) -> list:
+        self._validate('user', user)
+
+        with self._conn as cur:
+            cur.execute(sql['get_roles'], (user,))
+            rows = cur.fetchall()
+
+        return [row[0] for row in rows]
+
+
     def get_permissions(self, user: str):
         self._validate('user', user)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['get_permissions'], (user,))
             rows = cur.fetchall()
 
@@ -212,22 +611,128 @@ class Gatekeeper:
         self._validate('user', user)
         self._validate('permission', permission)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['remove_permission'], (user, permission))
+        self._invalidate()
 
 
     def create_permission(self, permission: str):
         self._validate('permission', permission)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['add_permission_type'], (permission,))
 
 
+    def ensure_permission(self, permission: str):
+        # create_permission, but fine if it already exists
+        self._validate('permission', permission)
+
+        with self._conn as cur:
+            cur.execute(sql['ensure_permission_type'], (permission,))
+
+
+    def create_permissions(self, permissions: list):
+        # Bulk form of create_permission, in one transaction
+        for permission in permissions:
+            self._validate('permission', permission)
+
+        try:
+            with self._conn as cur:
+                cur.executemany(sql['add_permission_type'], [(permission,) for permission in permissions])
+        except sqlite3.IntegrityError as e:
+            if e.args[0] == 'UNIQUE constraint failed: permission_types.pname':
+                raise GatekeeperException('Permission already exists')
+            else:
+                raise e
+
+
+    def create_permission_set(self, owner: str, permissions: list, public_user: str = None,
+                              public_permissions: list = (), expiry: datetime = None) -> str:
+        # Everything needed to protect a new resource, in one transaction: creates `permissions` and grants them all to
+        # `owner`, and optionally creates `public_user` holding `public_permissions`, returning a session token for it.
+        # Permissions or a public user of the same names are replaced, so that nothing granted on a previous resource
+        # with the same id carries over.
+        self._validate('user', owner)
+        for permission in permissions:
+            self._validate('permission', permission)
+        if public_user is not None:
+            self._validate('user', public_user)
+            for permission in public_permissions:
+                self._validate('permission', permission)
+            self._validate_expiry(expiry)
+
+        token = None
+        with self._conn as cur:
+            cur.execute(sql['delete_permission_types'], (json.dumps(permissions),))
+            cur.executemany(sql['add_permission_type'], [(permission,) for permission in permissions])
+            for permission in permissions:
+                self._apply_permission(cur, owner, permission)
+
+            if public_user is not None:
+                public_row = self._user_row(public_user, '')
+                cur.execute(sql['delete_user'], (public_user,))
+                cur.execute(sql['create_user'], public_row)
+                for permission in public_permissions:
+                    self._apply_permission(cur, public_user, permission)
+                if self._secret is not None:
+                    token = self._sign_session(public_user, expiry, public_row[3])
+                else:
+                    token = uuid.uuid4().hex
+                    cur.execute(sql['create_session'], (token, expiry, public_user))
+        self._invalidate()
+
+        return token
+
+
+    def delete_permission_set(self, permissions: list, users: list = ()):
+        # Undoes create_permission_set: deletes the permissions and users (with their sessions) in one transaction
+        for permission in permissions:
+            self._validate('permission', permission)
+        for user in users:
+            self._validate('user', user)
+
+        with self._conn as cur:
+            cur.execute(sql['delete_permission_types'], (json.dumps(permissions),))
+            cur.execute(sql['delete_users'], (json.dumps(list(users)),))
+        self._invalidate()
+
+
     def delete_permission(self, permission: str):
         self._validate('permission', permission)
 
-        with SqlConn(self.db_location) as cur:
+        with self._conn as cur:
             cur.execute(sql['delete_permission_type'], (permission,))
+        self._invalidate()
+
+
+    def get_permission_names(self, pattern: str = '%') -> list:
+        # `pattern` is matched with LIKE
+        self._validate('pattern', pattern)
+
+        with self._conn as cur:
+            cur.execute(sql['get_permission_names'], (pattern,))
+            rows = cur.fetchall()
+
+        return [row[0] for row in rows]
+
+
+    def delete_permissions(self, permissions: list) -> int:
+        for permission in permissions:
+            self._validate('permission', permission)
+
+        with self._conn as cur:
+            cur.execute(sql['delete_permission_types'], (json.dumps(permissions),))
+            deleted = cur.rowcount
+        self._invalidate()
+
+        return deleted
+
+
+    def optimize(self, vacuum: bool = False):
+        self._conn.autocommit('PRAGMA optimize;')
+        if vacuum:
+            self._conn.autocommit('VACUUM;')
+            self._conn.autocommit('PRAGMA wal_checkpoint(TRUNCATE);')
 
 
     def check_permission(self, session: str, permission: str, expiry: datetime = None) -> bool:
@@ -242,14 +747,18 @@ class Gatekeeper:
         if session == '':
             return False
 
-        with SqlConn(self.db_location) as cur:
-            cur.execute(sql['check_token_permission'], (session, permission, expiry))
-            results = cur.fetchone()
-        return bool(results)
+        user = self._session_user(session, expiry)
+        if user is None:
+            return False
 
+        return self._holds(self._get_user_permissions(user), permission)
 
-    def get_session_user(self, session: str, expiry: datetime = None) -> str:
+
+    def check_permissions(self, session: str, permissions: list, expiry: datetime = None) -> set:
+        # Bulk form of check_permission: returns the subset of `permissions` the session holds, in one query
         self._validate_nomin('session', session)
+        for permission in permissions:
+            self._validate('permission', permission)
 
         if not expiry:
             expiry = datetime.now()
@@ -257,13 +766,44 @@ class Gatekeeper:
         self._validate_expiry(expiry)
 
         if session == '':
-            return None
+            return set()
 
-        with SqlConn(self.db_location) as cur:
-            cur.execute(sql['get_session_user'], (session, expiry))
-            results = cur.fetchone()
+        user = self._session_user(session, expiry)
+        if user is None:
+            return set()
 
-        if not results:
+        granted = self._get_user_permissions(user)
+        return {permission for permission in permissions if self._holds(granted, permission)}
+
+
+    def get_session_permissions(self, session: str, expiry: datetime = None) -> frozenset:
+        # Everything the session's user holds, directly or through roles, patterns included
+        self._validate_nomin('session', session)
+
+        if not expiry:
+            expiry = datetime.now()
+
+        self._validate_expiry(expiry)
+
+        if session == '':
+            return frozenset()
+
+        user = self._session_user(session, expiry)
+        if user is None:
+            return frozenset()
+
+        return self._get_user_permissions(user)
+
+
+    def get_session_user(self, session: str, expiry: datetime = None) -> str:
+        self._validate_nomin('session', session)
+
+        if not expiry:
+            expiry = datetime.now()
+
+        self._validate_expiry(expiry)
+
+        if session == '':
             return None
 
-        return results[0]
+        return self._session_user(session, expiry)
@@ -1 +1,2 @@
-from .Gatekeeper import Gatekeeper, GatekeeperException
+from .Gatekeeper import Gatekeeper, GatekeeperException, GatekeeperBusy, merge_database, load_secret
+from .hasher import ScryptHasher, Sha512Hasher, make_hasher
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import threading
+import time
+import os
+
+
+class LruCache:
+    # Bounded mapping whose entries also go stale after `ttl` seconds. A ttl of 0 disables caching.
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, stored = entry
+            if time.monotonic() - stored > self.ttl:
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Generation:
+    # Tells processes sharing a database that cached auth state is out of date. Any change bumps the generation by
+    # replacing a small file next to the database; checking it is a single stat(), much cheaper than a query.
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def bump(self):
+        with self._lock:
+            try:
+                with open(self.path, 'r') as gen_f:
+                    count = int(gen_f.read() or 0)
+            except (FileNotFoundError, ValueError):
+                count = 0
+
+            # A fresh file each time, so the inode changes even if the clock doesn't
+            tmp_path = '{}.{}.{}'.format(self.path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as gen_f:
+                gen_f.write(str(count + 1))
+            os.replace(tmp_path, self.path)
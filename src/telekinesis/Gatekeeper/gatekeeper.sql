@@ -1,12 +1,12 @@
 --@create_users
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
   uname TEXT PRIMARY KEY,
   pass_hash TEXT,
   salt TEXT
 );
 
 --@create_sessions
-CREATE TABLE sessions (
+CREATE TABLE IF NOT EXISTS sessions (
   token TEXT PRIMARY KEY,
   expires DATE,
   uname TEXT,
@@ -14,7 +14,7 @@ CREATE TABLE sessions (
 );
 
 --@create_permissions
-CREATE TABLE permissions (
+CREATE TABLE IF NOT EXISTS permissions (
   uname TEXT NOT NULL,
   ptype INTEGER NOT NULL,
   PRIMARY KEY (uname, ptype),
@@ -23,27 +23,47 @@ CREATE TABLE permissions (
 );
 
 --@create_permission_types
-CREATE TABLE permission_types (
+CREATE TABLE IF NOT EXISTS permission_types (
   ptype INTEGER PRIMARY KEY,
   pname TEXT UNIQUE
 );
 
---@check_token_permission(token, permission_name, time_now)
-SELECT 1 FROM permissions
-  INNER JOIN users ON users.uname = permissions.uname
-  INNER JOIN sessions ON sessions.uname = users.uname
-  INNER JOIN permission_types ON permissions.ptype = permission_types.ptype
-WHERE sessions.token = ? AND permission_types.pname = ? AND sessions.expires > ?;
+--@create_memberships
+CREATE TABLE IF NOT EXISTS memberships (
+  uname TEXT NOT NULL,
+  role TEXT NOT NULL,
+  PRIMARY KEY (uname, role),
+  FOREIGN KEY (uname) REFERENCES users(uname) ON DELETE CASCADE,
+  FOREIGN KEY (role) REFERENCES users(uname) ON DELETE CASCADE
+);
+
+--@create_sessions_uname_index
+CREATE INDEX IF NOT EXISTS sessions_uname ON sessions (uname);
+
+--@create_sessions_expires_index
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
 
---@get_session_user(session, expiry)
-SELECT uname FROM sessions WHERE token = ? AND expires > ?;
+--@create_permissions_ptype_index
+CREATE INDEX IF NOT EXISTS permissions_ptype ON permissions (ptype);
 
---@create_user(uname, pass_hash, salt)
-INSERT INTO users (uname, pass_hash, salt) VALUES (?, ?, ?);
+--@add_users_epoch
+ALTER TABLE users ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0;
+
+--@create_memberships_role_index
+CREATE INDEX IF NOT EXISTS memberships_role ON memberships (role);
+
+--@get_session(session)
+SELECT uname, expires FROM sessions WHERE token = ?;
+
+--@create_user(uname, pass_hash, salt, epoch)
+INSERT INTO users (uname, pass_hash, salt, epoch) VALUES (?, ?, ?, ?);
 
 --@change_password(pass_hash, salt, uname)
 UPDATE users SET pass_hash = ?, salt = ? WHERE uname = ?;
 
+--@rehash_password(pass_hash, salt, uname, old_pass_hash)
+UPDATE users SET pass_hash = ?, salt = ? WHERE uname = ? AND pass_hash = ?;
+
 --@get_pass_hash(uname)
 SELECT pass_hash, salt FROM users WHERE uname = ?;
 
@@ -56,9 +76,24 @@ INSERT INTO sessions (token, expires, uname) VALUES (?, ?, ?);
 --@expire_sessions(expiry)
 DELETE FROM sessions WHERE expires < ?;
 
+--@purge_expired_sessions(expiry, batch_size)
+DELETE FROM sessions WHERE token IN (SELECT token FROM sessions WHERE expires < ? LIMIT ?);
+
 --@expire_sessions_user(uname)
 DELETE FROM sessions WHERE uname = ?;
 
+--@get_user_epoch(uname)
+SELECT epoch FROM users WHERE uname = ?;
+
+--@set_user_epoch(epoch, uname)
+UPDATE users SET epoch = ? WHERE uname = ?;
+
+--@get_user_names(pattern)
+SELECT uname FROM users WHERE uname LIKE ?;
+
+--@delete_users(unames_json)
+DELETE FROM users WHERE uname IN (SELECT value FROM json_each(?));
+
 --@add_permission(uname, pname)
 INSERT INTO permissions (uname, ptype) VALUES (?, (SELECT (ptype) FROM permission_types WHERE pname = ?));
 
@@ -67,11 +102,63 @@ SELECT permission_types.pname FROM permission_types
   INNER JOIN permissions ON permission_types.ptype = permissions.ptype
 WHERE permissions.uname = ?;
 
+--@get_effective_permissions(uname)
+WITH RECURSIVE holders(uname) AS (
+  SELECT ?
+  UNION
+  SELECT memberships.role FROM memberships INNER JOIN holders ON memberships.uname = holders.uname
+)
+SELECT DISTINCT permission_types.pname FROM permission_types
+  INNER JOIN permissions ON permission_types.ptype = permissions.ptype
+  INNER JOIN holders ON permissions.uname = holders.uname;
+
 --@remove_permission(uname, pname)
 DELETE FROM permissions WHERE uname = ? AND ptype = (SELECT ptype FROM permission_types WHERE pname = ?);
 
 --@add_permission_type(pname)
 INSERT INTO permission_types (pname) VALUES (?);
 
+--@ensure_permission_type(pname)
+INSERT OR IGNORE INTO permission_types (pname) VALUES (?);
+
 --@delete_permission_type(pname)
 DELETE FROM permission_types WHERE pname = ?;
+
+--@get_permission_names(pattern)
+SELECT pname FROM permission_types WHERE pname LIKE ?;
+
+--@delete_permission_types(pnames_json)
+DELETE FROM permission_types WHERE pname IN (SELECT value FROM json_each(?));
+
+--@add_membership(uname, role)
+INSERT INTO memberships (uname, role) VALUES (?, ?);
+
+--@remove_membership(uname, role)
+DELETE FROM memberships WHERE uname = ? AND role = ?;
+
+--@get_roles(uname)
+SELECT role FROM memberships WHERE uname = ?;
+
+--@get_users_table
+SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users';
+
+--@attach_legacy(location)
+ATTACH DATABASE ? AS legacy;
+
+--@detach_legacy
+DETACH DATABASE legacy;
+
+--@merge_users
+INSERT INTO main.users (uname, pass_hash, salt, epoch) SELECT uname, pass_hash, salt, epoch FROM legacy.users;
+
+--@merge_permission_types
+INSERT INTO main.permission_types (ptype, pname) SELECT ptype, pname FROM legacy.permission_types;
+
+--@merge_permissions
+INSERT INTO main.permissions (uname, ptype) SELECT uname, ptype FROM legacy.permissions;
+
+--@merge_memberships
+INSERT INTO main.memberships (uname, role) SELECT uname, role FROM legacy.memberships;
+
+--@merge_sessions
+INSERT INTO main.sessions (token, expires, uname) SELECT token, expires, uname FROM legacy.sessions;
@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha512, scrypt
+import threading
+import base64
+import fcntl
+import hmac
+import time
+import os
+
+
+class Sha512Hasher:
+    # The original scheme, a single salted SHA-512. Cheap to brute force, so it is only kept to check passwords stored
+    # with it; they are rehashed with the current hasher on the next login.
+    name = 'sha512'
+
+    @staticmethod
+    def _digest(password: str, salt: bytes) -> str:
+        hasher = sha512()
+        hasher.update(password.encode('utf-8'))
+        hasher.update(salt)
+        return hasher.hexdigest()
+
+    def hash(self, password: str) -> (str, str):
+        salt = os.urandom(128)
+        return self._digest(password, salt), base64.b64encode(salt).decode('utf-8')
+
+    def identifies(self, pass_hash: str) -> bool:
+        return len(pass_hash) == 128 and not pass_hash.startswith('$')
+
+    def verify(self, password: str, pass_hash: str, salt_b64: str) -> bool:
+        return hmac.compare_digest(self._digest(password, base64.b64decode(salt_b64)), pass_hash)
+
+    def needs_rehash(self, pass_hash: str) -> bool:
+        return False
+
+
+class ScryptHasher:
+    # Memory-hard: each hash needs 128 * n * r bytes, for n * r * p rounds. Hashes are stored as
+    # $scrypt$n=<n>,r=<r>,p=<p>$<key>, so they can still be checked after the cost is changed.
+    name = 'scrypt'
+    prefix = '$scrypt$'
+
+    def __init__(self, n: int = 16384, r: int = 8, p: int = 1):
+        self.n = int(n)
+        self.r = int(r)
+        self.p = int(p)
+        self.params = 'n={},r={},p={}'.format(self.n, self.r, self.p)
+
+    @staticmethod
+    def _derive(password: str, salt: bytes, n: int, r: int, p: int) -> str:
+        key = scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=64)
+        return base64.b64encode(key).decode('utf-8')
+
+    def hash(self, password: str) -> (str, str):
+        salt = os.urandom(16)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return '{}{}${}'.format(self.prefix, self.params, key), base64.b64encode(salt).decode('utf-8')
+
+    def identifies(self, pass_hash: str) -> bool:
+        return pass_hash.startswith(self.prefix)
+
+    def verify(self, password: str, pass_hash: str, salt_b64: str) -> bool:
+        try:
+            params, key = pass_hash[len(self.prefix):].split('$')
+            cost = dict(param.split('=') for param in params.split(','))
+            n, r, p = int(cost['n']), int(cost['r']), int(cost['p'])
+        except (ValueError, KeyError):
+            return False
+
+        return hmac.compare_digest(self._derive(password, base64.b64decode(salt_b64), n, r, p), key)
+
+    def needs_rehash(self, pass_hash: str) -> bool:
+        return not pass_hash.startswith('{}{}$'.format(self.prefix, self.params))
+
+
+def make_hasher(name: str = 'scrypt', scrypt_n: int = 16384, scrypt_r: int = 8, scrypt_p: int = 1):
+    if name == ScryptHasher.name:
+        return ScryptHasher(scrypt_n, scrypt_r, scrypt_p)
+    elif name == Sha512Hasher.name:
+        return Sha512Hasher()
+    raise ValueError('Unknown password hasher "{}", expected scrypt or sha512'.format(name))
+
+
+class HashPool:
+    # Runs password hashes on at most `workers` threads per process. Given `lock_path`, each of them also holds one of
+    # `workers` lock files while hashing, so that is the most that run at once across every process sharing the
+    # database, however many logins arrive: the rest of the machine is left to run scripts. Hashing releases the GIL,
+    # so the pool's threads don't hold up the request threads either.
+    def __init__(self, workers: int = 2, lock_path: str = None, timeout: float = 10):
+        self.workers = max(1, int(workers))
+        self.timeout = float(timeout)
+        self.lock_paths = ['{}.{}'.format(lock_path, i) for i in range(self.workers)] if lock_path else []
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # A forked process doesn't get the pool's threads, only the pool; start a new one
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher')
+                self._pid = os.getpid()
+            return self._pool
+
+    def _acquire(self, deadline: float):
+        delay = 0.005
+        while True:
+            for path in self.lock_paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+
+            if time.monotonic() > deadline:
+                raise TimeoutError()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def _run_locked(self, deadline: float, fn, args):
+        if time.monotonic() > deadline:
+            raise TimeoutError()  # Waited for a thread for too long already
+
+        if not self.lock_paths:
+            return fn(*args)
+
+        fd = self._acquire(deadline)
+        try:
+            return fn(*args)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def run(self, fn, *args):
+        # Raises TimeoutError if the hash couldn't start within `timeout` seconds
+        deadline = time.monotonic() + self.timeout
+        return self._get_pool().submit(self._run_locked, deadline, fn, args).result()
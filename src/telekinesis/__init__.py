@@ -1,2 +1,3 @@
 from .route import app as Telekinesis
-from .methods import initialize
+from .methods import initialize, start_worker
+from .maintenance import sweep_once
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import fcntl
+import time
+import re
+import os
+
+
+_keyed_lock = re.compile(r'^(script|user)-(\w+)\.\d+$')
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, msg, retry_after=1):
+        logging.warning(msg)
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class _Semaphore:
+    # Counting semaphore that works across gunicorn workers: one lock file per slot, held with flock.
+    # The kernel drops the lock if the holder dies, so a crashed worker can't leak slots.
+    def __init__(self, lock_dir: str, name: str, size: int):
+        self.paths = [os.path.join(lock_dir, '{}.{}'.format(name, i)) for i in range(size)]
+
+    def try_acquire(self):
+        for path in self.paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+
+def _release(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def user_key(username: str) -> str:
+    return hashlib.sha1(username.encode('utf-8')).hexdigest()[:16]
+
+
+def remove_lock(path: str) -> bool:
+    # Removes a lock file unless someone holds it. Someone may still open it just as it goes, and then holds a slot
+    # nobody else can see; only a script or user that no longer exists gets one run too many that way.
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    else:
+        os.remove(path)
+        return True
+    finally:
+        os.close(fd)
+
+
+def prune_locks(lock_dir: str, script_ids: set, usernames: list) -> int:
+    # Per script and per user lock files are made as they are first needed; this removes those of scripts and users
+    # that no longer exist, so the directory doesn't keep growing
+    user_keys = {user_key(username) for username in usernames}
+    removed = 0
+    for name in os.listdir(lock_dir):
+        match = _keyed_lock.match(name)
+        if not match:
+            continue
+
+        kind, key = match.groups()
+        stale = int(key) not in script_ids if kind == 'script' else key not in user_keys
+        if stale and remove_lock(os.path.join(lock_dir, name)):
+            removed += 1
+    return removed
+
+
+class Ticket:
+    def __init__(self, fds: list):
+        self.fds = fds
+
+    def release(self):
+        fds, self.fds = self.fds, []
+        for fd in fds:
+            _release(fd)
+
+    def detach(self) -> 'Ticket':
+        # Hands the slots over to a new ticket, for processes that keep running after the request that admitted them
+        fds, self.fds = self.fds, []
+        return Ticket(fds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
+    def __del__(self):
+        # Safety net for a ticket handed to a stream that the client never started reading
+        self.release()
+
+
+class AdmissionControl:
+    def __init__(self, lock_dir: str, max_running=0, max_running_script=0, max_running_user=0, max_queued=0,
+                 queue_timeout=10):
+        self.lock_dir = lock_dir
+        self.max_running = max_running
+        self.max_running_script = max_running_script
+        self.max_running_user = max_running_user
+        self.queue_timeout = queue_timeout
+
+        self.running = _Semaphore(lock_dir, 'running', max_running) if max_running > 0 else None
+        self.queue = _Semaphore(lock_dir, 'queued', max_queued) if max_queued > 0 else None
+
+    def _semaphores(self, script_id, username) -> list:
+        sems = []
+        if self.running:
+            sems.append(self.running)
+        if self.max_running_script > 0:
+            sems.append(_Semaphore(self.lock_dir, 'script-{}'.format(script_id), self.max_running_script))
+        if self.max_running_user > 0 and username:
+            sems.append(_Semaphore(self.lock_dir, 'user-{}'.format(user_key(username)), self.max_running_user))
+        return sems
+
+    @staticmethod
+    def _try_all(sems: list):
+        fds = []
+        for sem in sems:
+            fd = sem.try_acquire()
+            if fd is None:
+                for held in fds:
+                    _release(held)
+                return None
+            fds.append(fd)
+        return fds
+
+    def admit(self, script_id, username=None) -> Ticket:
+        sems = self._semaphores(script_id, username)
+
+        fds = self._try_all(sems)
+        if fds is not None:
+            return Ticket(fds)
+
+        queue_fd = self.queue.try_acquire() if self.queue else None
+        if queue_fd is None:
+            raise AdmissionRejected('Too many scripts running, rejected execution of script {}'.format(script_id))
+
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            delay = 0.01
+            while time.monotonic() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+
+                fds = self._try_all(sems)
+                if fds is not None:
+                    return Ticket(fds)
+        finally:
+            _release(queue_fd)
+
+        raise AdmissionRejected('Timed out waiting to run script {}'.format(script_id))
+
+
+control = AdmissionControl('')
+
+
+def set_limits(lock_dir: str, **kwargs):
+    global control
+
+    if not os.path.isdir(lock_dir):
+        os.mkdir(lock_dir, 0o700)
+
+    control = AdmissionControl(lock_dir, **{key: int(value) for key, value in kwargs.items()})
+
+
+def admit(script_id, username=None) -> Ticket:
+    return control.admit(script_id, username)
@@ -0,0 +1,94 @@
+import tempfile
+import os
+
+from .utils import encode_output
+
+
+class OutputCapture:
+    # Holds at most `limit` bytes of a process' output in memory. Once that is exceeded, the whole output is written to
+    # a spill file in `spill_dir` instead (up to `spill_limit` bytes, past which it is dropped), so worker memory stays
+    # bounded no matter how much a script prints.
+    def __init__(self, limit: int, spill_limit: int, spill_dir: str):
+        self.limit = limit
+        self.spill_limit = spill_limit
+        self.spill_dir = spill_dir
+
+        self.head = bytearray()
+        self.size = 0
+        self.dropped = 0
+        self.spill = None
+        self.spill_path = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.size > len(self.head)
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+
+        if self.spill is None:
+            if len(self.head) + len(chunk) <= self.limit:
+                self.head += chunk
+                return
+
+            self.spill = tempfile.NamedTemporaryFile(dir=self.spill_dir, prefix='output-', delete=False)
+            self.spill_path = self.spill.name
+            self.spill.write(self.head)
+            self.head += chunk[:self.limit - len(self.head)]
+
+        room = self.spill_limit - self.spill.tell()
+        if room < len(chunk):
+            self.dropped += len(chunk) - max(room, 0)
+            chunk = chunk[:max(room, 0)]
+        self.spill.write(chunk)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+    def encoded(self):
+        return encode_output(bytes(self.head), partial=self.truncated)
+
+
+limits = {
+    'limit': 1024 * 1024,
+    'spill_limit': 100 * 1024 * 1024,
+    'spill_dir': tempfile.gettempdir(),
+}
+
+
+def set_output_limits(spill_dir: str, output_limit=None, output_spill_limit=None):
+    if not os.path.isdir(spill_dir):
+        os.mkdir(spill_dir, 0o700)
+
+    limits['spill_dir'] = spill_dir
+    if output_limit is not None:
+        limits['limit'] = int(output_limit)
+    if output_spill_limit is not None:
+        limits['spill_limit'] = int(output_spill_limit)
+
+
+def new_capture() -> OutputCapture:
+    return OutputCapture(**limits)
+
+
+def new_output_file(prefix: str):
+    # For processes that write straight to disk and may outlive the worker that started them
+    return tempfile.NamedTemporaryFile(dir=limits['spill_dir'], prefix=prefix, delete=False)
+
+
+def collect_file(path: str) -> (bytes, int, str):
+    # Reads an output file back the way an OutputCapture would have held it: the head, the total size, and the path if
+    # the head isn't all of it. Files that fit under the limit are removed.
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as output_f:
+            head = output_f.read(limits['limit'])
+    except FileNotFoundError:
+        return b'', 0, None
+
+    if size <= limits['limit']:
+        os.remove(path)
+        path = None
+
+    return head, size, path
@@ -0,0 +1,86 @@
+import logging
+import fcntl
+import time
+import os
+
+from .models import Result
+from .admission import AdmissionRejected, remove_lock
+
+
+lock_dir = ''
+
+
+def set_lock_dir(directory: str):
+    global lock_dir
+    lock_dir = directory
+
+
+def prune_flights(lock_dir: str, script_ids: set) -> int:
+    # Removes the flight files of scripts that no longer exist
+    removed = 0
+    for name in os.listdir(lock_dir):
+        if name.startswith('flight-') and int(name[len('flight-'):]) not in script_ids and \
+                remove_lock(os.path.join(lock_dir, name)):
+            removed += 1
+    return removed
+
+
+def _lock_shared(fd, deadline: float) -> bool:
+    # Waits for the shared lock until `deadline`, backing off like admission does; returns whether it got it
+    delay = 0.01
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+
+def run_shared(script_id, run, ttl=0, version=None, wait_timeout=60) -> (dict, bool):
+    # Single-flight execution across all workers. The first caller takes an exclusive flock on the script's flight
+    # file and runs the script; anyone arriving while it runs waits on a shared lock, then reads the stored result.
+    # Returns the result and whether it came from someone else's run. Raises AdmissionRejected after waiting
+    # `wait_timeout` seconds for others' runs.
+    arrived = time.time()
+    deadline = time.monotonic() + wait_timeout
+    path = os.path.join(lock_dir, 'flight-{}'.format(script_id))
+    delay = 0.01
+
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.debug('Script {} is already running, waiting for its result'.format(script_id))
+                if not _lock_shared(fd, deadline):
+                    raise AdmissionRejected('Timed out waiting for a concurrent run of script {}'.format(script_id))
+                flight = Result.get_since(script_id, version, arrived)
+                if flight:
+                    return flight.result, True
+                # The run we waited on failed without a result, or finished before we arrived and others are still
+                # reading its result; try to run it ourselves, once they let go
+            else:
+                # A run may have finished between our arrival and getting the lock
+                flight = Result.get_since(script_id, version, arrived)
+                if flight:
+                    return flight.result, True
+
+                res = run()
+
+                # Failed or truncated runs are still handed to the waiters, but never served from the cache
+                finished = time.time()
+                expires = finished if res.get('errors') or res.get('truncated') else finished + ttl
+                Result(script_id, res, finished, expires, version).store()
+                return res, False
+
+        finally:
+            os.close(fd)
+
+        if time.monotonic() >= deadline:
+            raise AdmissionRejected('Timed out waiting for a concurrent run of script {}'.format(script_id))
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
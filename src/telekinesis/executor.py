@@ -1,13 +1,30 @@
 import subprocess
-import os
+import selectors
+import threading
+import logging
 import base64
+import json
+import signal
+import time
+import os
 import shlex
 
-from .models import Script
+from .models import Script, Job
+from .utils import encode_output
+from .sshpool import SshPool
+from .admission import Ticket
+from .capture import OutputCapture, new_capture, new_output_file, collect_file
 
 
 security = {}
 
+timeouts = {
+    'default_timeout': 10,
+    'kill_grace': 5,
+    # Longest timeout a sync or streamed run may have, as those hold a server worker throughout; 0 for no limit
+    'sync_limit': 0,
+}
+
 
 def set_security(security_type, **kwargs):
     global security
@@ -23,91 +40,443 @@ def set_security(security_type, **kwargs):
     elif security_type == 'ssh':
         security['type'] = 'ssh'
         security['ssh_args'] = shlex.split(kwargs['ssh_args'])
+        security['pool'] = SshPool(
+            ssh_args=security['ssh_args'],
+            control_dir=kwargs['control_dir'],
+            persist=int(kwargs.get('ssh_persist', 300)),
+        )
+
+
+def set_timeouts(default_timeout=None, kill_grace=None, sync_limit=None):
+    if default_timeout is not None:
+        timeouts['default_timeout'] = int(default_timeout)
+    if kill_grace is not None:
+        timeouts['kill_grace'] = int(kill_grace)
+    if sync_limit is not None:
+        timeouts['sync_limit'] = int(sync_limit)
+
+
+def _timeout(script_obj: Script) -> int:
+    return script_obj.timeout or timeouts['default_timeout']
+
+
+def too_long_for_sync(script_obj: Script) -> bool:
+    # Forked scripts return straight away, whatever their timeout
+    return not script_obj.fork and 0 < timeouts['sync_limit'] < _timeout(script_obj)
+
 
+def _signal_group(sp: subprocess.Popen, sig: int) -> bool:
+    # Returns False once the process group is gone. Processes that have changed user (the children of su in user
+    # security mode) can't be signalled by us; then only the process we started is, which passes it on.
+    try:
+        os.killpg(sp.pid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError as err:
+        logging.warning('Could not signal process group {} ({}), signalling only its leader'.format(sp.pid, err))
 
-def run_script(script_obj: Script):
-    script = script_obj.script
-    fork = script_obj.fork
+    if sp.poll() is not None:
+        return sig == 0
+    try:
+        sp.send_signal(sig)
+    except OSError as err:
+        logging.error('Could not signal process {}: {}'.format(sp.pid, err))
+    return True
 
+
+def _terminate(sp: subprocess.Popen):
+    # Scripts run in their own session, so the process group reaches everything they started (su / ssh included)
+    logging.info('Terminating process group {}'.format(sp.pid))
+    _signal_group(sp, signal.SIGTERM)
+
+    deadline = time.monotonic() + timeouts['kill_grace']
+    while time.monotonic() < deadline:
+        if sp.poll() is not None and not _signal_group(sp, 0):
+            return
+        time.sleep(0.05)
+
+    logging.warning('Process group {} outlived the grace period, killing it'.format(sp.pid))
+    _signal_group(sp, signal.SIGKILL)
+    try:
+        sp.wait(timeout=timeouts['kill_grace'])
+    except subprocess.TimeoutExpired:
+        logging.error('Process {} could not be killed, leaving it'.format(sp.pid))
+
+
+def _spawn(script: str, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+    # Returns the process along with whatever still has to be fed to its stdin
     working_dir = os.getenv('HOME')
 
     if security['type'] == 'none':
         sp = subprocess.Popen(
             args=script,
             stdin=None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=stdout,
+            stderr=stderr,
             shell=True,
             cwd=working_dir,
+            start_new_session=True,
         )
+        payload = None
 
     elif security['type'] == 'user':
         sp = subprocess.Popen(
             args=["su", security['username']],
             stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=stdout,
+            stderr=stderr,
             shell=False,
             cwd=working_dir,
+            start_new_session=True,
         )
-        sp.stdin.write(security['password'].encode('utf-8'))
-        sp.stdin.write(bytes([10]))
-        sp.stdin.write(script.encode('utf-8'))
+        payload = security['password'].encode('utf-8') + bytes([10]) + script.encode('utf-8')
 
     elif security['type'] == 'ssh':
         sp = subprocess.Popen(
-            args=["ssh", "-T"] + security['ssh_args'],
+            args=security['pool'].command(),
             stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=stdout,
+            stderr=stderr,
             shell=False,
             cwd=working_dir,
+            start_new_session=True,
         )
-        sp.stdin.write(script.encode('utf-8'))
+        payload = script.encode('utf-8')
 
     else:
         sp = None
+        payload = None
+
+    return sp, payload
+
+
+def _communicate(sp: subprocess.Popen, payload: bytes, timeout: int):
+    stdout = new_capture()
+    stderr = new_capture()
+    captures = {'stdout': stdout, 'stderr': stderr}
+    errors = None
+
+    try:
+        for name, chunk in _read_output(sp, payload, timeout):
+            captures[name].write(chunk)
+    except subprocess.TimeoutExpired:
+        sp.stdout.close()
+        sp.stderr.close()
+        _terminate(sp)
+        errors = 'Process did not terminate in a timely manner'
+    finally:
+        stdout.close()
+        stderr.close()
+
+    return stdout, stderr, errors
+
 
-    if fork:
+def _fill_job(job: Job, sp: subprocess.Popen, stdout: OutputCapture, stderr: OutputCapture, errors: str):
+    job.stdout = bytes(stdout.head)
+    job.stderr = bytes(stderr.head)
+    job.stdout_size = stdout.size
+    job.stderr_size = stderr.size
+    job.stdout_path = stdout.spill_path
+    job.stderr_path = stderr.spill_path
+    job.errors = errors
+    job.exit_status = None if errors else sp.returncode
+    job.finished = time.time()
+
+
+def _update_job(job: Job) -> bool:
+    # A job is deleted with its script, even while it runs; then nothing refers to its output files any more
+    if job.update():
+        return True
+
+    logging.info('Job {} was deleted with script {}, removing its output'.format(job.job_id, job.script_id))
+    Job.remove_output([job.stdout_path, job.stderr_path])
+    return False
+
+
+def run_script(script_obj: Script, ticket: Ticket = None):
+    if script_obj.fork:
+        job = start_forked(script_obj, ticket=ticket.detach() if ticket else None)
         return {
             'exit_status': '',
             'stdout': '',
             'stderr': '',
-            'pid': sp.pid,
+            'pid': job.pid,
+            'job_id': job.job_id,
         }
 
-    else:
+    started = time.time()
+    sp, payload = _spawn(script_obj.script)
+
+    stdout, stderr, errors = _communicate(sp, payload, _timeout(script_obj))
+
+    res = {
+        'pid': sp.pid,
+        'stdout': stdout.encoded(),
+        'stderr': stderr.encoded(),
+        'exit_status': '' if errors else sp.returncode,
+        'truncated': stdout.truncated or stderr.truncated,
+    }
+    if errors:
+        res['errors'] = errors
+
+    if res['truncated']:
+        # The full output is on disk; keep a finished job around as the handle for fetching it
+        job = Job(script_id=script_obj.script_id, status='timeout' if errors else 'finished', pid=sp.pid,
+                  started=started, script_version=script_obj.version)
+        job.store()
+        _fill_job(job, sp, stdout, stderr, errors)
+        if _update_job(job):
+            logging.info('Output of script {} was truncated, full output kept as job {}'.format(
+                script_obj.script_id, job.job_id))
+            res['job_id'] = job.job_id
+        res['stdout_size'] = stdout.size
+        res['stderr_size'] = stderr.size
+        res['stdout_dropped'] = stdout.dropped
+        res['stderr_dropped'] = stderr.dropped
+        if stdout.dropped or stderr.dropped:
+            logging.warning('Output of script {} went past the spill limit, the end of it was dropped'.format(
+                script_obj.script_id))
+
+    return res
+
+
+def start_job(script_obj: Script, ticket: Ticket = None) -> Job:
+    if script_obj.fork:
+        return start_forked(script_obj, ticket=ticket)
+
+    sp, payload = _spawn(script_obj.script)
+
+    job = Job(script_id=script_obj.script_id, status='running', pid=sp.pid, started=time.time(),
+              owner_pid=os.getpid(), script_version=script_obj.version)
+    job.store()
+    logging.info('Started job {} for script {} as pid {}'.format(job.job_id, job.script_id, job.pid))
+
+    waiter = threading.Thread(target=_finish_job, args=(job, sp, payload, _timeout(script_obj), ticket), daemon=True)
+    waiter.start()
+
+    return job
+
+
+def _finish_job(job: Job, sp: subprocess.Popen, payload: bytes, timeout: int, ticket: Ticket = None):
+    try:
+        stdout, stderr, errors = _communicate(sp, payload, timeout)
+        status = 'timeout' if errors else 'finished'
+    except Exception as err:
+        logging.error('Job {} failed while collecting output: {}'.format(job.job_id, err))
+        stdout, stderr, errors = new_capture(), new_capture(), 'Could not collect script output'
+        status = 'failed'
+    finally:
+        if ticket:
+            ticket.release()
+
+    _fill_job(job, sp, stdout, stderr, errors)
+    job.status = status
+    _update_job(job)
+    logging.info('Job {} is {} with exit status {}'.format(job.job_id, job.status, job.exit_status))
+
+
+def start_forked(script_obj: Script, ticket: Ticket = None) -> Job:
+    # Forked scripts run without a timeout and write straight to files rather than pipes, so they carry on (with their
+    # output) if this worker is recycled. A reaper thread waits on them so they don't linger as zombies.
+    stdout_f = new_output_file('fork-')
+    stderr_f = new_output_file('fork-')
+    try:
+        sp, payload = _spawn(script_obj.script, stdout=stdout_f, stderr=stderr_f)
+    finally:
+        stdout_f.close()
+        stderr_f.close()
+
+    if payload is not None:
         try:
-            stdout, stderr = sp.communicate(timeout=10)
-        except subprocess.TimeoutExpired:
-            sp.kill()
-            return {
-                'pid': sp.pid,
-                'stdout': '',
-                'stderr': '',
-                'exit_status': '',
-                'errors': 'Process did not terminate in a timely manner',
-            }
+            sp.stdin.write(payload)
+            sp.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    job = Job(script_id=script_obj.script_id, status='running', pid=sp.pid, started=time.time(),
+              stdout_path=stdout_f.name, stderr_path=stderr_f.name, owner_pid=os.getpid(),
+              script_version=script_obj.version)
+    job.store()
+    job.update()
+    logging.info('Forked script {} as pid {}, tracked as job {}'.format(job.script_id, job.pid, job.job_id))
+
+    reaper = threading.Thread(target=_reap_forked, args=(job, sp, ticket), daemon=True)
+    reaper.start()
+
+    return job
+
+
+def _exit_code(status: int) -> int:
+    # Same convention as Popen.returncode: negative for a signal
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _reap_forked(job: Job, sp: subprocess.Popen, ticket: Ticket = None):
+    try:
+        _, status, usage = os.wait4(sp.pid, 0)
+        sp.returncode = _exit_code(status)
+        job.status = 'finished'
+        job.exit_status = sp.returncode
+        job.user_time = usage.ru_utime
+        job.system_time = usage.ru_stime
+        job.max_rss = usage.ru_maxrss
+    except ChildProcessError:
+        logging.error('Forked job {} was reaped by someone else, exit status unknown'.format(job.job_id))
+        job.status = 'lost'
+    finally:
+        if ticket:
+            ticket.release()
+
+    _collect_forked(job)
+    logging.info('Forked job {} is {} with exit status {}'.format(job.job_id, job.status, job.exit_status))
+
+
+def _collect_forked(job: Job):
+    # Moves the start of the output files into the job, same as for any other job
+    job.stdout, job.stdout_size, job.stdout_path = collect_file(job.stdout_path) if job.stdout_path else (b'', 0, None)
+    job.stderr, job.stderr_size, job.stderr_path = collect_file(job.stderr_path) if job.stderr_path else (b'', 0, None)
+    job.finished = time.time()
+    _update_job(job)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reconcile(job: Job) -> Job:
+    # Jobs are only ever finished by the worker that started them. If that worker is gone (recycled or crashed), the
+    # process is either still running unsupervised -- "orphaned" -- or has exited with nobody to record how -- "lost".
+    if job.status not in ('running', 'orphaned') or not job.owner_pid or _alive(job.owner_pid):
+        return job
+
+    if _alive(job.pid):
+        if job.status != 'orphaned':
+            logging.warning('Worker {} running job {} is gone, pid {} is orphaned'.format(
+                job.owner_pid, job.job_id, job.pid))
+            job.status = 'orphaned'
+            job.update()
+        return job
+
+    logging.warning('Worker {} running job {} is gone and so is pid {}, marking it lost'.format(
+        job.owner_pid, job.job_id, job.pid))
+    job.status = 'lost'
+    job.errors = 'The worker supervising this job exited before the job finished'
+    if job.stdout_path and job.stdout is None:
+        # A forked job, whose output files are still complete
+        _collect_forked(job)
+    else:
+        job.finished = time.time()
+        job.update()
+    return job
+
+
+def reconcile_jobs():
+    for job in Job.get_running():
+        reconcile(job)
+
 
+def _read_output(sp: subprocess.Popen, payload: bytes, timeout: float):
+    # Yields ('stdout' | 'stderr', chunk) as the process writes, instead of buffering everything like communicate()
+    if payload is not None:
         try:
-            stdout = stdout.decode('utf-8')
-        except UnicodeDecodeError:
-            stdout = {
-                'data': base64.b64encode(stdout).decode('utf-8'),
-                'format': 'base64'
-            }
+            sp.stdin.write(payload)
+            sp.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        selector.register(sp.stdout, selectors.EVENT_READ, 'stdout')
+        selector.register(sp.stderr, selectors.EVENT_READ, 'stderr')
+
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(sp.args, timeout)
+
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, 32768)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                else:
+                    yield key.data, chunk
+
+    sp.wait(timeout=max(deadline - time.monotonic(), 0))
 
+
+class _ChunkDecoder:
+    # Like encode_output, but for a stream -- multi-byte characters may be split across chunks
+    def __init__(self):
+        self.pending = b''
+
+    def decode(self, chunk: bytes):
+        data = self.pending + chunk
+        self.pending = b''
         try:
-            stderr = stderr.decode('utf-8')
-        except UnicodeDecodeError:
-            stderr = {
-                'data': base64.b64encode(stderr).decode('utf-8'),
+            return data.decode('utf-8')
+        except UnicodeDecodeError as err:
+            if err.reason == 'unexpected end of data' and err.start > len(data) - 4:
+                self.pending = data[err.start:]
+                return data[:err.start].decode('utf-8')
+            return {
+                'data': base64.b64encode(data).decode('utf-8'),
                 'format': 'base64'
             }
 
-        return {
-            'pid': sp.pid,
-            'stdout': stdout,
-            'stderr': stderr,
-            'exit_status': sp.returncode,
-        }
+    def flush(self):
+        data = self.pending
+        self.pending = b''
+        return encode_output(data) if data else None
+
+
+def _sse(event: str, data) -> str:
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+def stream_script(script_obj: Script, ticket: Ticket = None):
+    # Yields server-sent events: "start" with the pid, "stdout" / "stderr" chunks as they arrive, then "exit" or "error"
+    try:
+        yield from _stream_events(script_obj)
+    finally:
+        if ticket:
+            ticket.release()
+
+
+def _stream_events(script_obj: Script):
+    sp, payload = _spawn(script_obj.script)
+    decoders = {'stdout': _ChunkDecoder(), 'stderr': _ChunkDecoder()}
+    yield _sse('start', {'pid': sp.pid})
+
+    try:
+        for name, chunk in _read_output(sp, payload, _timeout(script_obj)):
+            text = decoders[name].decode(chunk)
+            if text:
+                yield _sse(name, text)
+
+    except subprocess.TimeoutExpired:
+        _terminate(sp)
+        yield _sse('error', {'pid': sp.pid, 'errors': 'Process did not terminate in a timely manner'})
+        return
+
+    finally:
+        # Also reached when the client goes away mid-stream
+        if sp.poll() is None:
+            logging.info('Stream for pid {} ended early, killing the process'.format(sp.pid))
+            _terminate(sp)
+
+    for name, decoder in decoders.items():
+        text = decoder.flush()
+        if text:
+            yield _sse(name, text)
+
+    yield _sse('exit', {'pid': sp.pid, 'exit_status': sp.returncode})
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+import threading
+import logging
+import fcntl
+import time
+import re
+import os
+
+from . import models
+from .admission import prune_locks
+from .coalesce import prune_flights
+from .models import Script, Job, Revision
+from .utils import SqlConn
+from .Gatekeeper import Gatekeeper, merge_database
+
+
+settings = {
+    'interval': 3600,
+    'batch_size': 1000,
+    'job_retention': 7 * 24 * 3600,
+    'vacuum': False,
+}
+
+lock_dir = ''
+
+_script_permission = re.compile(r'^script\.(?:read|update|destroy|execute)\.(\d+)$')
+_public_user = re.compile(r'^#script\.public\.(\d+)$')
+
+
+def set_maintenance(interval=None, batch_size=None, job_retention=None, vacuum=None):
+    if interval is not None:
+        settings['interval'] = int(interval)
+    if batch_size is not None:
+        settings['batch_size'] = int(batch_size)
+    if job_retention is not None:
+        settings['job_retention'] = int(job_retention)
+    if vacuum is not None:
+        settings['vacuum'] = bool(vacuum)
+
+
+def set_lock_dir(directory: str):
+    global lock_dir
+    lock_dir = directory
+
+
+def _orphaned(names: list, pattern, script_ids: set) -> list:
+    orphaned = []
+    for name in names:
+        match = pattern.match(name)
+        if match and int(match.group(1)) not in script_ids:
+            orphaned.append(name)
+    return orphaned
+
+
+def sweep(auth: Gatekeeper, conn: SqlConn) -> OrderedDict:
+    # Deletes what has outlived its use, and returns how many rows of each kind went
+    started = time.time()
+    counts = OrderedDict()
+
+    counts['sessions'] = auth.purge_expired_sessions(batch_size=settings['batch_size'])
+
+    # Permissions and public users of scripts that don't exist, left behind when creating or deleting a script failed
+    # partway. Scripts are committed before their permissions are made (or with them, in unified storage), so reading
+    # the script ids last means a script being created right now can't look orphaned.
+    permission_names = auth.get_permission_names('script.%')
+    user_names = auth.get_user_names('#script.public.%')
+    script_ids = Script.get_ids()
+
+    orphaned_permissions = _orphaned(permission_names, _script_permission, script_ids)
+    orphaned_users = _orphaned(user_names, _public_user, script_ids)
+    counts['permissions'] = auth.delete_permissions(orphaned_permissions) if orphaned_permissions else 0
+    counts['users'] = auth.delete_users(orphaned_users) if orphaned_users else 0
+
+    counts['jobs'] = Job.purge_finished(time.time() - settings['job_retention'], batch_size=settings['batch_size'])
+    counts['blobs'] = Revision.purge_blobs(batch_size=settings['batch_size'])
+
+    # Lock files of scripts and users that are gone
+    counts['locks'] = 0
+    if os.path.isdir(lock_dir):
+        counts['locks'] = prune_locks(lock_dir, script_ids, auth.get_user_names()) + \
+            prune_flights(lock_dir, script_ids)
+
+    auth.optimize(vacuum=settings['vacuum'])
+    conn.autocommit('PRAGMA optimize;')
+    if settings['vacuum']:
+        conn.autocommit('VACUUM;')
+        conn.autocommit('PRAGMA wal_checkpoint(TRUNCATE);')
+
+    logging.info('Maintenance finished in {:.2f}s, removed {}'.format(
+        time.time() - started, ', '.join('{} {}'.format(count, kind) for kind, count in counts.items())))
+    return counts
+
+
+def start(auth: Gatekeeper, conn: SqlConn) -> threading.Thread:
+    # Sweeps every `interval` seconds in the background. Every server worker starts this once it has been forked (never
+    # the process that forks them), and only the one holding the lock file sweeps; if that worker exits, the lock goes
+    # with it and another takes over.
+    if settings['interval'] <= 0:
+        return None
+
+    def run():
+        fd = os.open(os.path.join(lock_dir, 'maintenance'), os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            time.sleep(settings['interval'])
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+
+            try:
+                sweep(auth, conn)
+            except Exception as err:
+                logging.error('Maintenance failed: {}'.format(err))
+
+    thread = threading.Thread(target=run, name='maintenance', daemon=True)
+    thread.start()
+    return thread
+
+
+def sweep_once(data_dir: str, storage: dict = None, unified_storage=False, **kwargs) -> OrderedDict:
+    # For running maintenance as its own command, e.g. from cron, instead of inside the server
+    set_maintenance(**kwargs)
+    set_lock_dir(os.path.join(data_dir, 'locks'))
+
+    conn = SqlConn(os.path.join(data_dir, 'telekinesis.db'), **(storage or {}))
+    if unified_storage:
+        merge_database(os.path.join(data_dir, 'security.db'), conn, storage=storage)
+        auth = Gatekeeper(conn.db_location, conn=conn)
+    else:
+        auth = Gatekeeper(os.path.join(data_dir, 'security.db'), storage=storage)
+    models.setup(auth=auth, conn=conn)
+
+    return sweep(auth, conn)
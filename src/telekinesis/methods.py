@@ -1,50 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
 from datetime import datetime
+from urllib.parse import urlencode
+import hashlib
+import difflib
 import os
+import re
+import json
+import time
 import logging
 
-from flask import request, jsonify
+from flask import request, jsonify, Response, send_file
+from werkzeug.http import quote_etag
 
-from .Gatekeeper import Gatekeeper, GatekeeperException
+from .Gatekeeper import Gatekeeper, GatekeeperException, GatekeeperBusy, merge_database, load_secret, make_hasher
 
 from .validator import validated_by, authorized_by, attach_authorizer
 from . import validator
-from .models import Script, User, Permissions
+from .models import Script, User, Job, Result, Revision, Permissions, same_script
 from . import models
 from .utils import SqlConn
 from . import executor
+from . import admission
+from . import capture
+from . import coalesce
+from . import maintenance
+from .admission import AdmissionRejected
 
 
-@validated_by(validator.script_create)
-@authorized_by(Permissions.script.create)
-def script_create(**jsn):
-    logging.debug('Entering script_create')
-    script = Script.from_dict(jsn)
-    script.store()
+# The API directory never changes while running, so it is read once and served from memory
+with open(os.path.join(os.path.dirname(__file__), 'swaggerfile.json'), 'rb') as _swagger_f:
+    _swagger = _swagger_f.read()
+_swagger_etag = hashlib.sha256(_swagger).hexdigest()[:32]
 
-    new_permissions = [
-        Permissions.script.read(script.script_id),
-        Permissions.script.update(script.script_id),
-        Permissions.script.destroy(script.script_id),
-        Permissions.script.execute(script.script_id),
-    ]
 
-    user = auth.get_session_user(request.cookies.get('session', ''))
-    logging.info('User {} has created new script {}'.format(user, script.script_id))
+def _cache_headers(etag: str, cache_control: str) -> dict:
+    return {'ETag': quote_etag(etag), 'Cache-Control': cache_control}
 
-    for p in new_permissions:
-        auth.create_permission(p)
-        auth.apply_permission(user, p)
 
-    logging.info('Creating public user for script {}'.format(script.script_id))
-    script_public_user = User.public(script.script_id)
-    auth.create_user(script_public_user, '')
-    auth.apply_permission(script_public_user, new_permissions[0])  # READ
-    auth.apply_permission(script_public_user, new_permissions[3])  # EXECUTE
+def _not_modified(etag: str, cache_control: str):
+    # The 304 for a client that already has this version, or None. If-None-Match compares weakly (RFC 7232).
+    if request.if_none_match.contains_weak(etag):
+        return '', 304, _cache_headers(etag, cache_control)
+    return None
 
-    public_token = auth.create_session(script_public_user, datetime(year=9000, month=1, day=1))
-    script.public_token = public_token
 
-    script.update()
+def _unit_of_work() -> SqlConn:
+    # One transaction around a whole operation: the model calls inside become savepoints of it, and so do the
+    # Gatekeeper's when both share one database (unified storage). The operation then commits once, or not at all.
+    return db
+
+
+unified = False
+
+
+@validated_by(validator.script_create)
+@authorized_by(Permissions.script.create)
+def script_create(**jsn):
+    logging.debug('Entering script_create')
+    script = Script.from_dict(jsn)
+    if not unified:
+        # The permissions are committed in the other database straight away, and maintenance deletes permissions of
+        # scripts it can't see, so the script has to be there first
+        script.store()
+
+    try:
+        with _unit_of_work():
+            if unified:
+                script.store()
+
+            new_permissions = [
+                Permissions.script.read(script.script_id),
+                Permissions.script.update(script.script_id),
+                Permissions.script.destroy(script.script_id),
+                Permissions.script.execute(script.script_id),
+            ]
+
+            user = auth.get_session_user(request.cookies.get('session', ''))
+            logging.info('User {} has created new script {}'.format(user, script.script_id))
+
+            # If this fails the script goes too, as nobody could use or delete it without its permissions
+            logging.info('Creating permissions and public user for script {}'.format(script.script_id))
+            script.public_token = auth.create_permission_set(
+                owner=user,
+                permissions=new_permissions,
+                public_user=User.public(script.script_id),
+                public_permissions=[new_permissions[0], new_permissions[3]],  # READ, EXECUTE
+                expiry=datetime(year=9000, month=1, day=1),
+            )
+
+            script.update()
+    except Exception:
+        if not unified:
+            script.delete()  # Already committed; in unified storage, it is rolled back with the rest
+        raise
     logging.info('New script was created successfully')
 
     return jsonify(script.as_dict()), 200
@@ -54,13 +103,23 @@ def script_create(**jsn):
 @authorized_by(Permissions.script.read, field='script_id')
 def script_read(script_id):
     logging.debug('Entering script_read on id {}'.format(script_id))
+
+    # Readers poll scripts; if they have the current version, only that needs looking up. Always revalidated, as
+    # whether the caller may still read it is checked on every request.
+    cache_control = 'private, no-cache'
+    version = Script.get_version(script_id)
+    if version is not None:
+        not_modified = _not_modified(Script(script_id=script_id, version=version).etag(), cache_control)
+        if not_modified:
+            return not_modified
+
     script = Script.get(script_id)
 
     if not script:
         logging.warning('Searched for and found no script with id {}'.format(script_id))
         return jsonify({'errors': 'No such script {}'.format(script_id)}), 400
 
-    return jsonify(script.as_dict()), 200
+    return jsonify(script.as_dict()), 200, _cache_headers(script.etag(), cache_control)
 
 
 @validated_by(validator.script_update, pathargs=['script_id'])
@@ -74,7 +133,9 @@ def script_update(script_id, **jsn):
         return jsonify({'errors': 'No such script {}'.format(script_id)}), 400
 
     script.update_from_dict(jsn)
-    script.update()
+    with _unit_of_work():
+        script.update()
+        Result(script_id).delete()
     logging.debug('Script was updated successfully')
 
     return jsonify(script.as_dict()), 200
@@ -91,14 +152,15 @@ def script_destroy(script_id):
         Permissions.script.execute(script_id),
     ]
 
-    logging.info('Removing old permissions from deleted script {}'.format(script_id))
-    for p in old_permissions:
-        auth.delete_permission(p)
-
-    logging.info('Removing old public user from script {}'.format(script_id))
-    auth.delete_user(User.public(script_id))
+    with _unit_of_work():
+        logging.info('Removing old permissions and public user from deleted script {}'.format(script_id))
+        auth.delete_permission_set(old_permissions, [User.public(script_id)])
 
-    Script(script_id).delete()
+        Script(script_id).delete()
+        Result(script_id).delete()
+        # Its id may be given to the next script created, which mustn't inherit these
+        spilled = Job.delete_for_script(script_id)
+    Job.remove_output(spilled)
     logging.info('Deletion successful')
 
     return '', 200
@@ -106,30 +168,421 @@ def script_destroy(script_id):
 
 @validated_by(validator.script_execute, pathargs=['script_id'])
 @authorized_by(Permissions.script.execute, field='script_id')
-def script_execute(script_id):
-    logging.debug('Entering script_execute on script {}'.format(script_id))
+def script_execute(script_id, mode):
+    logging.debug('Entering script_execute on script {} in mode {}'.format(script_id, mode))
     script = Script.get(script_id)
 
     if not script:
         logging.warning('Searched for and found no script with id {}'.format(script_id))
         return jsonify({'errors': 'No such script {}'.format(script_id)}), 400
 
-    resp = executor.run_script(script)
-    logging.debug('Script was run successfully')
+    return _execute(script, mode)
+
+
+def _execute(script: Script, mode: str):
+    session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
+    username = auth.get_session_user(session) if admission.control.max_running_user > 0 else None
+
+    try:
+        if mode == 'async':
+            job = executor.start_job(script, ticket=admission.admit(script.script_id, username))
+            logging.debug('Script was started as job {}'.format(job.job_id))
+            return jsonify(job.as_dict()), 202
+
+        if executor.too_long_for_sync(script):
+            logging.warning('Refused to run script {} in mode {}, its timeout is too long'.format(
+                script.script_id, mode))
+            return jsonify({'errors': _too_long_error(script)}), 400
+
+        if mode == 'stream' and not script.fork:
+            logging.debug('Streaming output of script {}'.format(script.script_id))
+            ticket = admission.admit(script.script_id, username)
+            return Response(executor.stream_script(script, ticket=ticket), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+            })
+
+        resp = _execute_sync(script, username)
+
+    except AdmissionRejected as err:
+        return jsonify({'errors': str(err)}), 429, {'Retry-After': str(err.retry_after)}
 
+    logging.debug('Script was run successfully')
     return jsonify(resp), 200
 
 
-@authorized_by(Permissions.scripts.read)
-def scripts_read():
-    logging.debug('Entering scripts_read, reading list of all scripts')
-    scripts = Script.get_all()
+def _execute_sync(script: Script, username: str) -> dict:
+    # Doesn't touch the request, so batches can call it from their own threads
+    ttl = _cache_ttl(script)
+    if ttl:
+        cached = Result.get(script.script_id, script.version)
+        if cached:
+            logging.debug('Returning cached result for script {}'.format(script.script_id))
+            cached.result['cached'] = True
+            return cached.result
+
+    if script.coalesce and not script.fork:
+        resp, shared = coalesce.run_shared(
+            script.script_id, lambda: _run_admitted(script, username), ttl=ttl, version=script.version,
+            wait_timeout=_longest_run(script))
+        if shared:
+            logging.debug('Returning result of a concurrent run of script {}'.format(script.script_id))
+            resp['coalesced'] = True
+        return resp
+
+    resp = _run_admitted(script, username)
+
+    if ttl and not resp.get('errors') and not resp.get('truncated'):
+        finished = time.time()
+        Result(script.script_id, resp, finished, finished + ttl, script.version).store()
+
+    return resp
+
+
+def _run_admitted(script: Script, username: str) -> dict:
+    with admission.admit(script.script_id, username) as ticket:
+        # Forked scripts take the ticket with them and hold it until they exit
+        return executor.run_script(script, ticket=ticket)
+
+
+def _too_long_error(script: Script) -> str:
+    return 'Script {} may run for longer than {} seconds, the most a request can wait; run it in async mode'.format(
+        script.script_id, executor.timeouts['sync_limit'])
+
+
+def _longest_run(script: Script) -> int:
+    # Queueing for a slot, running until the timeout, then being killed
+    return admission.control.queue_timeout + (script.timeout or executor.timeouts['default_timeout']) + \
+        executor.timeouts['kill_grace']
+
+
+def _cache_ttl(script: Script) -> int:
+    if not script.cacheable or script.fork:
+        return 0
+    return script.cache_ttl or models.result.default_ttl
+
+
+@validated_by(validator.scripts_execute)
+def scripts_execute(script_ids, parallelism, stream):
+    logging.debug('Entering scripts_execute on scripts {}'.format(script_ids))
+    session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
+    script_ids = list(OrderedDict.fromkeys(script_ids))
+
+    granted = auth.check_permissions(session, [Permissions.script.execute(script_id) for script_id in script_ids])
+    denied = [script_id for script_id in script_ids if Permissions.script.execute(script_id) not in granted]
+    if denied:
+        logging.warning('Batch execution refused, no execute permission on scripts {}'.format(denied))
+        return jsonify({
+            'errors': 'Insufficient permission: requires permission {}'.format(Permissions.script.execute(denied[0]))
+        }), 401
+
+    scripts = Script.get_many(script_ids)
+    missing = [script_id for script_id in script_ids if script_id not in scripts]
+    if missing:
+        logging.warning('Batch execution refused, no scripts with ids {}'.format(missing))
+        return jsonify({'errors': 'No such scripts {}'.format(missing)}), 400
+
+    username = auth.get_session_user(session) if admission.control.max_running_user > 0 else None
+
+    def run(script: Script) -> dict:
+        try:
+            resp = {'errors': _too_long_error(script)} if executor.too_long_for_sync(script) else \
+                _execute_sync(script, username)
+        except AdmissionRejected as err:
+            resp = {'errors': str(err), 'retry_after': err.retry_after}
+        finally:
+            # Each pool thread opens its own connections, which would outlive the pool
+            db.close()
+            auth.close()
+        resp['script_id'] = script.script_id
+        return resp
+
+    if stream:
+        def results():
+            with ThreadPoolExecutor(max_workers=parallelism) as pool:
+                for future in as_completed([pool.submit(run, scripts[script_id]) for script_id in script_ids]):
+                    yield future.result()
+
+        return _ndjson(results()), 200
+
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        res = list(pool.map(run, [scripts[script_id] for script_id in script_ids]))
+
+    logging.debug('Batch of {} scripts was run successfully'.format(len(res)))
+    return jsonify(res), 200
+
+
+@validated_by(validator.script_revisions, pathargs=['script_id'])
+@authorized_by(Permissions.script.read, field='script_id')
+def script_revisions(script_id):
+    logging.debug('Entering script_revisions on id {}'.format(script_id))
+    revisions = Revision.get_all(script_id)
+
+    if not revisions:
+        logging.warning('Searched for and found no script with id {}'.format(script_id))
+        return jsonify({'errors': 'No such script {}'.format(script_id)}), 400
+
+    return jsonify([revision.as_dict() for revision in revisions]), 200
+
+
+@validated_by(validator.script_revision_read, pathargs=['script_id', 'revision'])
+@authorized_by(Permissions.script.read, field='script_id')
+def script_revision_read(script_id, revision):
+    logging.debug('Entering script_revision_read on id {} revision {}'.format(script_id, revision))
+    found = Revision.get(script_id, revision)
+
+    if not found:
+        logging.warning('Searched for and found no revision {} of script {}'.format(revision, script_id))
+        return jsonify({'errors': 'No such revision {} of script {}'.format(revision, script_id)}), 400
+
+    # A revision never changes, so its hash is its ETag
+    cache_control = 'private, no-cache'
+    not_modified = _not_modified(found.hash, cache_control)
+    if not_modified:
+        return not_modified
+
+    return jsonify(found.as_dict()), 200, _cache_headers(found.hash, cache_control)
+
+
+@validated_by(validator.script_revision_execute, pathargs=['script_id', 'revision'])
+@authorized_by(Permissions.script.execute, field='script_id')
+def script_revision_execute(script_id, revision, mode):
+    logging.debug('Entering script_revision_execute on script {} revision {} in mode {}'.format(
+        script_id, revision, mode))
+    script = Script.get(script_id)
+    pinned = Revision.get(script_id, revision)
+
+    if not script or not pinned:
+        logging.warning('Searched for and found no revision {} of script {}'.format(revision, script_id))
+        return jsonify({'errors': 'No such revision {} of script {}'.format(revision, script_id)}), 400
+
+    # Runs with the script's current settings. Cached and coalesced results are those of the current body, so an
+    # older one always runs on its own.
+    if pinned.hash != script.hash:
+        script.script = pinned.script
+        script.hash = pinned.hash
+        script.revision = pinned.revision
+        script.cacheable = False
+        script.coalesce = False
+
+    return _execute(script, mode)
+
+
+@validated_by(validator.script_diff, pathargs=['script_id'], queryargs=['from', 'to'])
+@authorized_by(Permissions.script.read, field='script_id')
+def script_diff(script_id, **jsn):
+    logging.debug('Entering script_diff on id {}'.format(script_id))
+    existing = Revision.get_all(script_id)
+    if not existing:
+        logging.warning('Searched for and found no script with id {}'.format(script_id))
+        return jsonify({'errors': 'No such script {}'.format(script_id)}), 400
+
+    # By default, what the latest revision changed
+    to_revision = jsn.get('to', existing[-1].revision)
+    from_revision = jsn.get('from', max(to_revision - 1, 1))
+
+    revisions = {}
+    for number in (from_revision, to_revision):
+        revisions[number] = Revision.get(script_id, number)
+        if not revisions[number]:
+            logging.warning('Searched for and found no revision {} of script {}'.format(number, script_id))
+            return jsonify({'errors': 'No such revision {} of script {}'.format(number, script_id)}), 400
+
+    before, after = revisions[from_revision], revisions[to_revision]
+    diff = difflib.unified_diff(
+        before.script.splitlines(keepends=True),
+        after.script.splitlines(keepends=True),
+        fromfile='script/{}/revisions/{}'.format(script_id, from_revision),
+        tofile='script/{}/revisions/{}'.format(script_id, to_revision),
+    )
+
+    # A body's last line may have no newline; say so, as diff(1) does, rather than run it into the next line
+    lines = (line if line.endswith('\n') else line + '\n\\ No newline at end of file\n' for line in diff)
+    return Response(''.join(lines), mimetype='text/x-diff'), 200
+
+
+def _readable_job(job_id=None, pid=None) -> Job:
+    session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
+    job = Job.get(job_id) if pid is None else Job.get_by_pid(pid)
+
+    # Jobs are visible to anyone who could have started them, i.e. anyone with execute on the script (the same one, not
+    # a later one given its id)
+    if not job or not same_script(job.script_version, Script.get_version(job.script_id)) or \
+            not auth.check_permission(session, Permissions.script.execute(job.script_id)):
+        logging.warning('Job {} does not exist or may not be read with this token'.format(
+            job_id if pid is None else 'with pid {}'.format(pid)))
+        return None
+
+    return executor.reconcile(job)
+
+
+@validated_by(validator.job_read, pathargs=['job_id'])
+def job_read(job_id):
+    logging.debug('Entering job_read on job {}'.format(job_id))
+    job = _readable_job(job_id)
+
+    if not job:
+        return jsonify({
+            'errors': 'No such job {}, or insufficient permission to read it'.format(job_id)
+        }), 401
+
+    return jsonify(job.as_dict()), 200
+
+
+@validated_by(validator.job_read_pid, pathargs=['pid'])
+def job_read_pid(pid):
+    logging.debug('Entering job_read_pid on pid {}'.format(pid))
+    job = _readable_job(pid=pid)
+
+    if not job:
+        return jsonify({
+            'errors': 'No job with pid {}, or insufficient permission to read it'.format(pid)
+        }), 401
+
+    return jsonify(job.as_dict()), 200
+
+
+@validated_by(validator.job_output, pathargs=['job_id', 'stream'])
+def job_output(job_id, stream):
+    logging.debug('Entering job_output on job {}, stream {}'.format(job_id, stream))
+    job = _readable_job(job_id)
+
+    if not job:
+        return jsonify({
+            'errors': 'No such job {}, or insufficient permission to read it'.format(job_id)
+        }), 401
+
+    path = job.output_path(stream)
+    if not path:
+        return Response(job.output_head(stream), mimetype='application/octet-stream'), 200
+
+    if not os.path.isfile(path):
+        logging.warning('Spilled {} of job {} is missing from {}'.format(stream, job_id, path))
+        return jsonify({'errors': 'Output of job {} is no longer available'.format(job_id)}), 400
+
+    return send_file(path, mimetype='application/octet-stream'), 200
+
+
+def _ndjson(items) -> Response:
+    # Streams a collection as one line of JSON per item, as it is produced, instead of building it all first
+    def lines():
+        for item in items:
+            yield json.dumps(item) + '\n'
+
+    return Response(lines(), mimetype='application/x-ndjson')
+
+
+def _wants_ndjson(stream: bool) -> bool:
+    return stream or request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == \
+        'application/x-ndjson'
+
+
+def _project(script: Script, fields: list) -> dict:
+    script_dict = script.as_dict()
+    if fields is None:
+        return script_dict
+    return {key: script_dict[key] for key in ['script_id'] + fields}
+
+
+_script_read_permission = re.compile(r'^script\.read\.(\d+)$')
+
+
+def _readable_script_ids(session: str) -> list:
+    # The ids of the scripts the session may read, or None if that is all of them
+    if (
+            auth.check_permission(session, Permissions.scripts.read) or
+            auth.check_permission(session, Permissions.script.read('*'))
+    ):
+        return None
+
+    matches = (_script_read_permission.match(permission) for permission in auth.get_session_permissions(session))
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+@validated_by(validator.scripts_read, queryargs=['after', 'limit', 'q', 'accessible', 'fields', 'stream'])
+def scripts_read(after, accessible, stream, limit=None, q=None, fields=None):
+    logging.debug('Entering scripts_read, reading list of scripts after {}'.format(after))
+    session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
+
+    # Everything needs scripts.read, but anyone can list the scripts they may read
+    if accessible:
+        if not auth.get_session_user(session):
+            logging.debug('Invalid token, refused to list scripts')
+            return jsonify({
+                'errors': 'Invalid or expired token'
+            }), 401
+        script_ids = _readable_script_ids(session)
+    elif auth.check_permission(session, Permissions.scripts.read):
+        script_ids = None
+    else:
+        logging.warning('Authorization failed for token {} on permission {}'.format(session, Permissions.scripts.read))
+        return jsonify({
+            'errors': 'Insufficient permission: requires permission {}'.format(Permissions.scripts.read)
+        }), 401
+
+    with_script = fields is None or 'script' in fields
+    if _wants_ndjson(stream):
+        # Each line carries its script_id, so there is no Link header: continue after the last one read
+        scripts = Script.iter_pages(after, limit, q, script_ids, with_script)
+        return _ndjson(_project(script, fields) for script in scripts), 200
+
+    # One extra row tells whether there is a next page
+    scripts = Script.get_page(
+        after=after,
+        limit=limit + 1 if limit else None,
+        description=q,
+        script_ids=script_ids,
+        with_script=with_script,
+    )
+
+    headers = {}
+    if limit and len(scripts) > limit:
+        scripts = scripts[:limit]
+        args = request.args.to_dict()
+        args['after'] = scripts[-1].script_id
+        headers['Link'] = '<{}?{}>; rel="next"'.format(request.base_url, urlencode(args))
 
     res = []
     for script in scripts:
-        res.append(script.as_dict())
+        res.append(_project(script, fields))
 
-    return jsonify(res), 200
+    return jsonify(res), 200, headers
+
+
+@validated_by(validator.scripts_search, queryargs=['q', 'limit', 'offset'])
+def scripts_search(q, limit, offset):
+    logging.debug('Entering scripts_search')
+    session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
+
+    # Anyone can search the scripts they may read
+    if not auth.get_session_user(session):
+        logging.debug('Invalid token, refused to search scripts')
+        return jsonify({
+            'errors': 'Invalid or expired token'
+        }), 401
+
+    # One extra result tells whether there is a next page
+    found = Script.search(q, limit=limit + 1, offset=offset, script_ids=_readable_script_ids(session))
+
+    headers = {}
+    if len(found) > limit:
+        found = found[:limit]
+        args = request.args.to_dict()
+        args['offset'] = offset + limit
+        headers['Link'] = '<{}?{}>; rel="next"'.format(request.base_url, urlencode(args))
+
+    res = []
+    for script, score, snippet in found:
+        res.append({
+            'script_id': script.script_id,
+            'description': script.description,
+            'hash': script.hash,
+            'revision': script.revision,
+            'score': score,
+            'snippet': snippet,
+        })
+
+    return jsonify(res), 200, headers
 
 
 @validated_by(validator.user_create)
@@ -139,6 +592,8 @@ def user_create(**jsn):
 
     try:
         User.from_dict(jsn).store()
+    except GatekeeperBusy as err:
+        return jsonify({'errors': str(err)}), 429, {'Retry-After': '1'}
     except GatekeeperException as err:
         return jsonify({'errors': str(err)}), 400
 
@@ -196,7 +651,11 @@ def permission_create(**jsn):
     session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
 
     # Script[x] permissions are weird -- users with script.update.[x] can grant them to other users
-    if jsn['permission'].startswith('script.') and jsn['permission'] != 'script.create':
+    # Patterns (script.execute.* etc.) cover many scripts, so only permission.create may grant them
+    if (
+            jsn['permission'].startswith('script.') and jsn['permission'] != 'script.create' and
+            not jsn['permission'].endswith('*')
+    ):
         script_id = jsn['permission'].split('.')[2]
         logging.info('Script permission on script {} -- checking permission sharing first'.format(script_id))
 
@@ -218,6 +677,9 @@ def permission_create(**jsn):
             'errors': 'Insufficient permission: requires permission {}'.format(Permissions.permission.create)
         }), 401
 
+    if jsn['permission'].endswith('*'):
+        # Patterns aren't made ahead of time like script permissions, so the first grant of one creates it
+        auth.ensure_permission(jsn['permission'])
     auth.apply_permission(jsn['username'], jsn['permission'])
     logging.info('Permission created')
     return '', 200
@@ -229,7 +691,10 @@ def permission_delete(**jsn):
     session = request.token if hasattr(request, 'token') else request.cookies.get('session', '')
 
     # Can remove script[x] permissions from public users if script.update.[x] permitted
-    if jsn['permission'].startswith('script.') and jsn['permission'] != 'script.create':
+    if (
+            jsn['permission'].startswith('script.') and jsn['permission'] != 'script.create' and
+            not jsn['permission'].endswith('*')
+    ):
         script_id = jsn['permission'].split('.')[2]
         logging.info('Script permission on script {} -- checking public user management first'.format(script_id))
 
@@ -256,9 +721,40 @@ def permission_delete(**jsn):
     return '', 200
 
 
+@validated_by(validator.role_create)
+@authorized_by(Permissions.permission.create)
+def role_create(**jsn):
+    # Membership of a role grants everything it holds, so it takes the same permission as granting those directly
+    logging.info('Entering role_create, adding user {} to role {}'.format(jsn['username'], jsn['role']))
+
+    try:
+        User(username=jsn['username']).add_role(jsn['role'])
+    except GatekeeperException as err:
+        return jsonify({'errors': str(err)}), 400
+
+    logging.info('Role added')
+    return '', 200
+
+
+@validated_by(validator.role_delete)
+@authorized_by(Permissions.permission.destroy)
+def role_delete(**jsn):
+    logging.info('Entering role_delete, removing user {} from role {}'.format(jsn['username'], jsn['role']))
+
+    User(username=jsn['username']).remove_role(jsn['role'])
+
+    logging.info('Role removed')
+    return '', 200
+
+
 @validated_by(validator.user_login)
 def login(**jsn):
-    if auth.login(jsn['username'], jsn['password']):
+    try:
+        valid = auth.login(jsn['username'], jsn['password'])
+    except GatekeeperBusy as err:
+        return jsonify({'errors': str(err)}), 429, {'Retry-After': '1'}
+
+    if valid:
         logging.info('Logging in user {}'.format(jsn['username']))
         session = auth.create_session(jsn['username'], datetime(year=9000, month=1, day=1))
         return jsonify({'session': session}), 200, {'set-cookie': 'session={}'.format(session)}
@@ -268,30 +764,63 @@ def login(**jsn):
 
 
 def directory():
-    swagger_path = os.path.join(os.path.dirname(__file__), 'swaggerfile.json')
-    with open(swagger_path, 'r') as swagger_f:
-        swagger = swagger_f.read()
-    return swagger, 200, {'content-type': 'application/json'}
+    cache_control = 'public, max-age=300'
+    not_modified = _not_modified(_swagger_etag, cache_control)
+    if not_modified:
+        return not_modified
+
+    headers = _cache_headers(_swagger_etag, cache_control)
+    headers['content-type'] = 'application/json'
+    return _swagger, 200, headers
 
 
-def initialize(admin_username, admin_password, data_dir, security):
-    global auth
+def initialize(admin_username, admin_password, data_dir, security, limits=None, output_limits=None, timeouts=None,
+               cache_entries=None, auth_cache=None, storage=None, maintenance_settings=None, unified_storage=False,
+               signed_sessions=False, password_hashing=None):
+    global auth, db, unified
 
     logging.info('Initializing database connection')
 
     gatekeeper_db = os.path.join(data_dir, 'security.db')
-    auth = Gatekeeper(gatekeeper_db)
-
     telekinesis_db = os.path.join(data_dir, 'telekinesis.db')
-    conn = SqlConn(telekinesis_db)
+    conn = SqlConn(telekinesis_db, **(storage or {}))
+    db = conn
+    unified = unified_storage
+
+    # Signed sessions are checked without a query; every worker reads the same key
+    secret = load_secret(os.path.join(data_dir, 'session.key')) if signed_sessions else None
+
+    hashing = dict(password_hashing or {})
+    hash_workers = int(hashing.pop('hash_workers', 2))
+    hasher = make_hasher(**hashing)
+
+    if unified_storage:
+        # Security tables live in telekinesis.db too, so one transaction can cover a whole request
+        if merge_database(gatekeeper_db, conn, storage=storage):
+            logging.info('Moved security data from {} into {}'.format(gatekeeper_db, telekinesis_db))
+        auth = Gatekeeper(telekinesis_db, conn=conn, secret=secret, hasher=hasher, hash_workers=hash_workers,
+                          **(auth_cache or {}))
+    else:
+        auth = Gatekeeper(gatekeeper_db, storage=storage, secret=secret, hasher=hasher, hash_workers=hash_workers,
+                          **(auth_cache or {}))
 
     models.setup(auth=auth, conn=conn)
-    os.chmod(gatekeeper_db, 0o600)
+    if cache_entries is not None:
+        models.result.set_max_entries(cache_entries)
+    if not unified_storage:
+        os.chmod(gatekeeper_db, 0o600)
     os.chmod(telekinesis_db, 0o600)
 
     attach_authorizer(auth)
 
-    executor.set_security(**security)
+    executor.set_security(control_dir=data_dir, **security)
+    executor.set_timeouts(**(timeouts or {}))
+    admission.set_limits(os.path.join(data_dir, 'locks'), **(limits or {}))
+    coalesce.set_lock_dir(os.path.join(data_dir, 'locks'))
+    maintenance.set_lock_dir(os.path.join(data_dir, 'locks'))
+    capture.set_output_limits(os.path.join(data_dir, 'output'), **(output_limits or {}))
+    executor.reconcile_jobs()
+    maintenance.set_maintenance(**(maintenance_settings or {}))
     test = executor.run_script(Script(script="echo \"Hello world!\"", fork=False))
     if test['stdout'] != 'Hello world!\n':
         logging.critical('Telekinesis SSH test <echo "Hello world!"> failed, check your SSH config')
@@ -329,3 +858,13 @@ def initialize(admin_username, admin_password, data_dir, security):
                 logging.info('Permission does not exist, will create')
                 auth.create_permission(p)
                 auth.apply_permission(admin_username, p)
+
+    # Gunicorn forks the workers after this; none of them should inherit an open database connection
+    conn.close()
+    auth.close()
+
+
+def start_worker():
+    # Run in each server worker once it has been forked; threads started before then would be lost in the fork, or be
+    # forked partway through something
+    maintenance.start(auth, db)
@@ -1,22 +1,118 @@
 from __future__ import absolute_import
 
 from .user import User
-from .script import Script
+from .script import Script, content_hash, same_script
+from .job import Job
+from .result import Result
+from .revision import Revision
 from .permission import Permissions
 
 from .user import attach_auth as _user_attach_auth
 from .script import attach_sql as _script_attach_sql
+from .job import attach_sql as _job_attach_sql
+from .result import attach_sql as _result_attach_sql
+from .revision import attach_sql as _revision_attach_sql
 
-from ..utils import load_sql, SqlConn
+from ..utils import load_sql, SqlConn, migrate
 from ..Gatekeeper import Gatekeeper
+import time
 import os
 
 
+sql = load_sql(os.path.join(os.path.dirname(__file__), 'create_db.sql'))
+
+
+def _migrate_1(cur):
+    # Everything from before versioned migrations. Databases made back then may have any part of it, so this only adds
+    # what is missing.
+    cur.execute(sql['create_scripts'])
+    cur.execute(sql['create_jobs'])
+    cur.execute(sql['create_results'])
+
+    added_columns = {
+        'scripts': ['timeout', 'cacheable', 'cache_ttl', 'coalesce'],
+        'jobs': ['owner_pid', 'user_time', 'system_time', 'max_rss'],
+    }
+    for table, added in added_columns.items():
+        cur.execute(sql['get_{}_columns'.format(table)])
+        columns = {row[1] for row in cur.fetchall()}
+        for column in added:
+            if column not in columns:
+                cur.execute(sql['add_{}_{}'.format(table, column)])
+
+
+def _migrate_2(cur):
+    # Looking up jobs by pid, and finding the running ones
+    cur.execute(sql['create_jobs_pid_index'])
+    cur.execute(sql['create_jobs_status_index'])
+
+
+def _migrate_3(cur):
+    # Purging old jobs
+    cur.execute(sql['create_jobs_finished_index'])
+
+
+def _migrate_4(cur):
+    # A version per script, bumped on every update, for ETags
+    cur.execute(sql['add_scripts_version'])
+
+
+def _migrate_5(cur):
+    # Script bodies move to blobs keyed by their hash, shared by every script and revision with that body. What each
+    # script had becomes its first revision.
+    cur.execute(sql['create_blobs'])
+    cur.execute(sql['create_revisions'])
+    cur.execute(sql['create_revisions_hash_index'])
+    cur.execute(sql['add_scripts_hash'])
+    cur.execute(sql['add_scripts_revision'])
+
+    cur.execute(sql['get_scripts_bodies'])
+    now = time.time()
+    for script_id, body in cur.fetchall():
+        body = body or ''
+        body_hash = content_hash(body)
+        cur.execute(sql['put_blob'], (body_hash, body))
+        cur.execute(sql['set_scripts_hash'], (body_hash, script_id))
+        cur.execute(sql['put_first_revision'], (script_id, body_hash, now))
+
+
+def _migrate_6(cur):
+    # Full-text search over descriptions and bodies. The index keeps no copy of them, only reads them back for
+    # snippets; matches in a description rank above matches in a body.
+    cur.execute(sql['create_script_texts'])
+    cur.execute(sql['create_scripts_search'])
+    cur.execute(sql['rank_scripts_search'])
+    cur.execute(sql['rebuild_scripts_search'])
+
+
+def _migrate_7(cur):
+    # Results of the version of the script they came from. Those stored before can't be told apart, so they are dropped.
+    cur.execute(sql['add_results_version'])
+    cur.execute(sql['clear_results'])
+
+
+def _migrate_8(cur):
+    # Lets the blob sweep and the foreign key check on deleting a blob look up the scripts using it
+    cur.execute(sql['create_scripts_hash_index'])
+
+
+def _migrate_9(cur):
+    # Jobs are only readable through the script that started them, not another given its id after it was deleted.
+    # Jobs of scripts already gone get no version, so nobody can read them.
+    cur.execute(sql['add_jobs_script_version'])
+    cur.execute(sql['set_jobs_script_version'])
+
+
+_migrations = [
+    _migrate_1, _migrate_2, _migrate_3, _migrate_4, _migrate_5, _migrate_6, _migrate_7, _migrate_8, _migrate_9,
+]
+
+
 def setup(auth: Gatekeeper, conn: SqlConn):
     _user_attach_auth(auth)
     _script_attach_sql(conn)
+    _job_attach_sql(conn)
+    _result_attach_sql(conn)
+    _revision_attach_sql(conn)
 
-    if not os.path.isfile(conn.db_location):
-        sql = load_sql(os.path.join(os.path.dirname(__file__), 'create_db.sql'))
-        with conn as cur:
-            cur.execute(sql['create_scripts'])
+    migrate(conn, _migrations, 'telekinesis', legacy_component='telekinesis')
@@ -1,8 +1,153 @@
 --@create_scripts
-CREATE TABLE scripts (
+CREATE TABLE IF NOT EXISTS scripts (
   id INTEGER PRIMARY KEY,
   script TEXT,
   description TEXT,
   fork BOOLEAN,
-  public_token TEXT
+  public_token TEXT,
+  timeout INTEGER,
+  cacheable BOOLEAN,
+  cache_ttl INTEGER,
+  coalesce BOOLEAN
 );
+
+--@get_scripts_columns
+PRAGMA table_info(scripts);
+
+--@add_scripts_timeout
+ALTER TABLE scripts ADD COLUMN timeout INTEGER;
+
+--@add_scripts_cacheable
+ALTER TABLE scripts ADD COLUMN cacheable BOOLEAN;
+
+--@add_scripts_cache_ttl
+ALTER TABLE scripts ADD COLUMN cache_ttl INTEGER;
+
+--@add_scripts_coalesce
+ALTER TABLE scripts ADD COLUMN coalesce BOOLEAN;
+
+--@create_jobs
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY,
+  script_id INTEGER,
+  status TEXT,
+  pid INTEGER,
+  exit_status INTEGER,
+  stdout BLOB,
+  stderr BLOB,
+  stdout_size INTEGER,
+  stderr_size INTEGER,
+  stdout_path TEXT,
+  stderr_path TEXT,
+  started REAL,
+  finished REAL,
+  errors TEXT,
+  owner_pid INTEGER,
+  user_time REAL,
+  system_time REAL,
+  max_rss INTEGER
+);
+
+--@get_jobs_columns
+PRAGMA table_info(jobs);
+
+--@add_jobs_owner_pid
+ALTER TABLE jobs ADD COLUMN owner_pid INTEGER;
+
+--@add_jobs_user_time
+ALTER TABLE jobs ADD COLUMN user_time REAL;
+
+--@add_jobs_system_time
+ALTER TABLE jobs ADD COLUMN system_time REAL;
+
+--@add_jobs_max_rss
+ALTER TABLE jobs ADD COLUMN max_rss INTEGER;
+
+--@create_jobs_pid_index
+CREATE INDEX IF NOT EXISTS jobs_pid ON jobs (pid);
+
+--@create_jobs_status_index
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+
+--@create_jobs_finished_index
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+
+--@add_jobs_script_version
+ALTER TABLE jobs ADD COLUMN script_version INTEGER;
+
+--@set_jobs_script_version
+UPDATE jobs SET script_version = (SELECT version FROM scripts WHERE scripts.id = jobs.script_id);
+
+--@create_results
+CREATE TABLE IF NOT EXISTS results (
+  script_id INTEGER PRIMARY KEY,
+  result TEXT,
+  finished REAL,
+  expires REAL
+);
+
+--@add_results_version
+ALTER TABLE results ADD COLUMN version INTEGER;
+
+--@clear_results
+DELETE FROM results;
+
+--@add_scripts_version
+ALTER TABLE scripts ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
+
+--@create_blobs
+CREATE TABLE IF NOT EXISTS blobs (
+  hash TEXT PRIMARY KEY,
+  body TEXT NOT NULL
+);
+
+--@create_revisions
+CREATE TABLE IF NOT EXISTS revisions (
+  script_id INTEGER NOT NULL,
+  revision INTEGER NOT NULL,
+  hash TEXT NOT NULL,
+  created REAL,
+  PRIMARY KEY (script_id, revision),
+  FOREIGN KEY (script_id) REFERENCES scripts(id) ON DELETE CASCADE,
+  FOREIGN KEY (hash) REFERENCES blobs(hash)
+);
+
+--@create_revisions_hash_index
+CREATE INDEX IF NOT EXISTS revisions_hash ON revisions (hash);
+
+--@add_scripts_hash
+ALTER TABLE scripts ADD COLUMN hash TEXT REFERENCES blobs(hash);
+
+--@create_scripts_hash_index
+CREATE INDEX IF NOT EXISTS scripts_hash ON scripts (hash);
+
+--@add_scripts_revision
+ALTER TABLE scripts ADD COLUMN revision INTEGER NOT NULL DEFAULT 1;
+
+--@get_scripts_bodies
+SELECT id, script FROM scripts;
+
+--@put_blob (hash, body)
+INSERT OR IGNORE INTO blobs (hash, body) VALUES (?, ?);
+
+--@set_scripts_hash (hash, script_id)
+UPDATE scripts SET script = NULL, hash = ? WHERE id = ?;
+
+--@put_first_revision (script_id, hash, created)
+INSERT INTO revisions (script_id, revision, hash, created) VALUES (?, 1, ?, ?);
+
+--@create_script_texts
+CREATE VIEW IF NOT EXISTS script_texts AS
+SELECT scripts.id AS id, scripts.description AS description, blobs.body AS script
+FROM scripts LEFT JOIN blobs ON blobs.hash = scripts.hash;
+
+--@create_scripts_search
+CREATE VIRTUAL TABLE IF NOT EXISTS scripts_search USING fts5 (
+  description, script, content = 'script_texts', content_rowid = 'id'
+);
+
+--@rank_scripts_search
+INSERT INTO scripts_search (scripts_search, rank) VALUES ('rank', 'bm25(4.0, 1.0)');
+
+--@rebuild_scripts_search
+INSERT INTO scripts_search (scripts_search) VALUES ('rebuild');
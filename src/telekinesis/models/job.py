@@ -0,0 +1,193 @@
+from __future__ import absolute_import
+
+import os
+import json
+from datetime import datetime
+
+from ..utils import SqlConn, load_sql, encode_output
+
+
+def attach_sql(connection: SqlConn):
+    global conn
+    conn = connection
+
+
+sql = load_sql(os.path.join(os.path.dirname(__file__), 'job.sql'))
+
+
+class Job:
+    def __init__(self, job_id=None, script_id=None, status=None, pid=None, exit_status=None, stdout=None,
+                 stderr=None, started=None, finished=None, errors=None, stdout_size=None, stderr_size=None,
+                 stdout_path=None, stderr_path=None, owner_pid=None, user_time=None, system_time=None, max_rss=None,
+                 script_version=None):
+        self.job_id = job_id
+        self.script_id = script_id
+        self.status = status
+        self.pid = pid
+        self.exit_status = exit_status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.started = started
+        self.finished = finished
+        self.errors = errors
+        # The stdout / stderr columns only hold what fit under the output limit; the rest is in the spill files
+        self.stdout_size = stdout_size
+        self.stderr_size = stderr_size
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        # The worker responsible for reaping the process, and the resources the process used once it has been reaped
+        self.owner_pid = owner_pid
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+        # Version of the script when the job started
+        self.script_version = script_version
+
+    def _clone(self, other: 'Job'):
+        self.job_id = other.job_id
+        self.script_id = other.script_id
+        self.status = other.status
+        self.pid = other.pid
+        self.exit_status = other.exit_status
+        self.stdout = other.stdout
+        self.stderr = other.stderr
+        self.started = other.started
+        self.finished = other.finished
+        self.errors = other.errors
+        self.stdout_size = other.stdout_size
+        self.stderr_size = other.stderr_size
+        self.stdout_path = other.stdout_path
+        self.stderr_path = other.stderr_path
+        self.owner_pid = other.owner_pid
+        self.user_time = other.user_time
+        self.system_time = other.system_time
+        self.max_rss = other.max_rss
+        self.script_version = other.script_version
+
+    @staticmethod
+    def get(job_id) -> 'Job':
+        with conn as cur:
+            cur.execute(sql['get_job_by_id'], (job_id,))
+            row = cur.fetchone()
+
+        if not row:
+            return None
+        else:
+            return Job(*row)
+
+    @staticmethod
+    def get_by_pid(pid) -> 'Job':
+        # Pids get reused, so this is the most recent job that ran as `pid`
+        with conn as cur:
+            cur.execute(sql['get_job_by_pid'], (pid,))
+            row = cur.fetchone()
+
+        if not row:
+            return None
+        else:
+            return Job(*row)
+
+    @staticmethod
+    def get_running() -> list:
+        with conn as cur:
+            cur.execute(sql['get_running_jobs'])
+            rows = cur.fetchall()
+
+        return [Job(*row) for row in rows]
+
+    @staticmethod
+    def purge_finished(before: float, batch_size: int = 1000) -> int:
+        # Deletes jobs that finished before `before`, along with their spilled output
+        purged = 0
+        while True:
+            with conn as cur:
+                cur.execute(sql['get_jobs_finished_before'], (before, batch_size))
+                rows = cur.fetchall()
+            # Finished jobs never change again, so they can be deleted in a separate (write) transaction
+            with conn as cur:
+                cur.execute(sql['delete_jobs'], (json.dumps([row[0] for row in rows]),))
+
+            Job.remove_output([path for _, stdout_path, stderr_path in rows for path in (stdout_path, stderr_path)])
+
+            purged += len(rows)
+            if len(rows) < batch_size:
+                return purged
+
+    @staticmethod
+    def delete_for_script(script_id) -> list:
+        # Deletes every job of the script, returning their spill files. Those are left for the caller to remove (with
+        # remove_output) once this is committed.
+        with conn as cur:
+            cur.execute(sql['get_script_jobs'], (script_id,))
+            rows = cur.fetchall()
+            cur.execute(sql['delete_jobs'], (json.dumps([row[0] for row in rows]),))
+
+        return [path for _, stdout_path, stderr_path in rows for path in (stdout_path, stderr_path) if path]
+
+    @staticmethod
+    def remove_output(paths: list):
+        for path in paths:
+            if path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def store(self):
+        with conn as cur:
+            cur.execute(sql['put_job'], (
+                self.script_id, self.status, self.pid, self.started, self.owner_pid, self.script_version,
+            ))
+            cur.execute(sql['get_last_id'])
+            row = cur.fetchone()
+
+        self.job_id = row[0]
+
+    def update(self) -> bool:
+        # False if the job is gone, deleted along with its script
+        with conn as cur:
+            cur.execute(sql['update_job'], (
+                self.status, self.pid, self.exit_status, self.stdout, self.stderr, self.finished, self.errors,
+                self.stdout_size, self.stderr_size, self.stdout_path, self.stderr_path, self.user_time, self.system_time,
+                self.max_rss, self.job_id,
+            ))
+            return cur.rowcount > 0
+
+    def refresh(self):
+        self._clone(self.get(self.job_id))
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.stdout_path or self.stderr_path)
+
+    def output_path(self, stream: str) -> str:
+        return {'stdout': self.stdout_path, 'stderr': self.stderr_path}[stream]
+
+    def output_head(self, stream: str) -> bytes:
+        return {'stdout': self.stdout, 'stderr': self.stderr}[stream] or b''
+
+    def as_dict(self) -> dict:
+        res = {
+            'job_id': self.job_id,
+            'script_id': self.script_id,
+            'status': self.status,
+            'pid': self.pid,
+            'exit_status': '' if self.exit_status is None else self.exit_status,
+            'stdout': encode_output(self.stdout or b'', partial=bool(self.stdout_path)),
+            'stderr': encode_output(self.stderr or b'', partial=bool(self.stderr_path)),
+            'stdout_size': self.stdout_size,
+            'stderr_size': self.stderr_size,
+            'truncated': self.truncated,
+            'started': datetime.fromtimestamp(self.started).isoformat() if self.started else None,
+            'finished': datetime.fromtimestamp(self.finished).isoformat() if self.finished else None,
+            'duration': (self.finished - self.started) if self.finished and self.started else None,
+        }
+        if self.user_time is not None:
+            res['rusage'] = {
+                'user_time': self.user_time,
+                'system_time': self.system_time,
+                'max_rss': self.max_rss,
+            }
+        if self.errors:
+            res['errors'] = self.errors
+        return res
@@ -0,0 +1,36 @@
+--@get_job_by_id (job_id)
+SELECT id, script_id, status, pid, exit_status, stdout, stderr, started, finished, errors,
+  stdout_size, stderr_size, stdout_path, stderr_path, owner_pid, user_time, system_time, max_rss, script_version
+FROM jobs WHERE id = ?;
+
+--@get_job_by_pid (pid)
+SELECT id, script_id, status, pid, exit_status, stdout, stderr, started, finished, errors,
+  stdout_size, stderr_size, stdout_path, stderr_path, owner_pid, user_time, system_time, max_rss, script_version
+FROM jobs WHERE pid = ? ORDER BY id DESC LIMIT 1;
+
+--@get_running_jobs
+SELECT id, script_id, status, pid, exit_status, stdout, stderr, started, finished, errors,
+  stdout_size, stderr_size, stdout_path, stderr_path, owner_pid, user_time, system_time, max_rss, script_version
+FROM jobs WHERE status IN ('running', 'orphaned');
+
+--@put_job (script_id, status, pid, started, owner_pid, script_version)
+INSERT INTO jobs (script_id, status, pid, started, owner_pid, script_version) VALUES (?, ?, ?, ?, ?, ?);
+
+--@get_last_id
+SELECT last_insert_rowid();
+
+--@update_job (status, pid, exit_status, stdout, stderr, finished, errors, stdout_size, stderr_size, stdout_path, stderr_path, user_time, system_time, max_rss, job_id)
+UPDATE jobs SET status = ?, pid = ?, exit_status = ?, stdout = ?, stderr = ?, finished = ?, errors = ?,
+  stdout_size = ?, stderr_size = ?, stdout_path = ?, stderr_path = ?, user_time = ?, system_time = ?, max_rss = ?
+WHERE id = ?;
+
+--@get_jobs_finished_before (finished, batch_size)
+SELECT id, stdout_path, stderr_path FROM jobs
+WHERE finished < ? AND status NOT IN ('running', 'orphaned')
+LIMIT ?;
+
+--@delete_jobs (job_ids_json)
+DELETE FROM jobs WHERE id IN (SELECT value FROM json_each(?));
+
+--@get_script_jobs (script_id)
+SELECT id, stdout_path, stderr_path FROM jobs WHERE script_id = ?;
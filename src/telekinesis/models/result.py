@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+
+import os
+import json
+import time
+
+from ..utils import SqlConn, load_sql
+
+
+def attach_sql(connection: SqlConn):
+    global conn
+    conn = connection
+
+
+sql = load_sql(os.path.join(os.path.dirname(__file__), 'result.sql'))
+
+max_entries = 1000
+default_ttl = 60
+keep_finished = 60
+
+
+def set_max_entries(entries):
+    global max_entries
+    max_entries = int(entries)
+
+
+class Result:
+    # The last stored run of a script, shared by every worker. Kept in the database rather than in memory so that
+    # updating or deleting a script on one worker invalidates it for all of them.
+    # Results past `expires` are no longer served from the cache, but are kept for a while so that callers waiting on a
+    # coalesced run can still pick them up.
+    # Each is of one `version` of the script, and only served for that version: a run that started before the script
+    # was updated may still finish, and store its result, after the update.
+    def __init__(self, script_id=None, result=None, finished=None, expires=None, version=None):
+        self.script_id = script_id
+        self.result = result
+        self.finished = finished
+        self.expires = expires
+        self.version = version
+
+    @staticmethod
+    def get(script_id, version, time_now=None) -> 'Result':
+        if time_now is None:
+            time_now = time.time()
+
+        with conn as cur:
+            cur.execute(sql['get_result'], (script_id, version, time_now))
+            row = cur.fetchone()
+
+        if not row:
+            return None
+        else:
+            return Result(script_id=row[0], result=json.loads(row[1]), finished=row[2], expires=row[3], version=row[4])
+
+    @staticmethod
+    def get_since(script_id, version, finished) -> 'Result':
+        with conn as cur:
+            cur.execute(sql['get_result_since'], (script_id, version, finished))
+            row = cur.fetchone()
+
+        if not row:
+            return None
+        else:
+            return Result(script_id=row[0], result=json.loads(row[1]), finished=row[2], expires=row[3], version=row[4])
+
+    def store(self):
+        with conn as cur:
+            cur.execute(sql['put_result'], (
+                self.script_id, json.dumps(self.result), self.finished, self.expires, self.version))
+            cur.execute(sql['delete_expired_results'], (time.time(), time.time() - keep_finished))
+            cur.execute(sql['evict_results'], (max_entries,))
+
+    def delete(self):
+        with conn as cur:
+            cur.execute(sql['delete_result'], (self.script_id,))
@@ -0,0 +1,17 @@
+--@get_result (script_id, version, time_now)
+SELECT script_id, result, finished, expires, version FROM results WHERE script_id = ? AND version = ? AND expires > ?;
+
+--@get_result_since (script_id, version, finished)
+SELECT script_id, result, finished, expires, version FROM results WHERE script_id = ? AND version = ? AND finished >= ?;
+
+--@put_result (script_id, result, finished, expires, version)
+INSERT OR REPLACE INTO results (script_id, result, finished, expires, version) VALUES (?, ?, ?, ?, ?);
+
+--@delete_result (script_id)
+DELETE FROM results WHERE script_id = ?;
+
+--@delete_expired_results (time_now, finished)
+DELETE FROM results WHERE expires <= ? AND finished <= ?;
+
+--@evict_results (max_entries)
+DELETE FROM results WHERE script_id NOT IN (SELECT script_id FROM results ORDER BY expires DESC LIMIT ?);
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+
+import os
+import json
+
+from ..utils import SqlConn, load_sql
+
+
+def attach_sql(connection: SqlConn):
+    global conn
+    conn = connection
+
+
+sql = load_sql(os.path.join(os.path.dirname(__file__), 'revision.sql'))
+
+
+class Revision:
+    # One body a script has had. Bodies are blobs named by their hash (see script.content_hash), so revisions, and
+    # scripts, with the same body share it; the hash is also a stable key for what a revision runs.
+    def __init__(self, script_id=None, revision=None, hash=None, created=None, script=None):
+        self.script_id = script_id
+        self.revision = revision
+        self.hash = hash
+        self.created = created
+        self.script = script
+
+    @staticmethod
+    def get(script_id, revision) -> 'Revision':
+        with conn as cur:
+            cur.execute(sql['get_revision'], (script_id, revision))
+            row = cur.fetchone()
+
+        return Revision(*row) if row else None
+
+    @staticmethod
+    def get_all(script_id) -> ['Revision']:
+        # Without their bodies
+        with conn as cur:
+            cur.execute(sql['get_revisions'], (script_id,))
+            rows = cur.fetchall()
+
+        return [Revision(*row) for row in rows]
+
+    @staticmethod
+    def purge_blobs(batch_size: int = 1000) -> int:
+        # Deletes bodies no script or revision has any more, e.g. after scripts were deleted. They are checked again
+        # when deleting, in case a script was given one of them meanwhile.
+        purged = 0
+        while True:
+            with conn as cur:
+                cur.execute(sql['get_orphaned_blobs'], (batch_size,))
+                hashes = [row[0] for row in cur.fetchall()]
+            with conn as cur:
+                cur.execute(sql['delete_orphaned_blobs'], (json.dumps(hashes),))
+                purged += cur.rowcount
+
+            if len(hashes) < batch_size:
+                return purged
+
+    def as_dict(self) -> dict:
+        revision_dict = {
+            'script_id': self.script_id,
+            'revision': self.revision,
+            'hash': self.hash,
+            'created': self.created,
+        }
+        if self.script is not None:
+            revision_dict['script'] = self.script
+        return revision_dict
@@ -0,0 +1,21 @@
+--@get_revisions (script_id)
+SELECT script_id, revision, hash, created
+FROM revisions WHERE script_id = ?
+ORDER BY revision;
+
+--@get_revision (script_id, revision)
+SELECT script_id, revision, revisions.hash, created, blobs.body
+FROM revisions JOIN blobs ON blobs.hash = revisions.hash
+WHERE script_id = ? AND revision = ?;
+
+--@get_orphaned_blobs (limit)
+SELECT hash FROM blobs
+WHERE NOT EXISTS (SELECT 1 FROM revisions WHERE revisions.hash = blobs.hash)
+  AND NOT EXISTS (SELECT 1 FROM scripts WHERE scripts.hash = blobs.hash)
+LIMIT ?;
+
+--@delete_orphaned_blobs (hashes_json)
+DELETE FROM blobs
+WHERE hash IN (SELECT value FROM json_each(?))
+  AND NOT EXISTS (SELECT 1 FROM revisions WHERE revisions.hash = blobs.hash)
+  AND NOT EXISTS (SELECT 1 FROM scripts WHERE scripts.hash = blobs.hash);
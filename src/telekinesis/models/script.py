@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 
 import os
+import json
+import time
+import hashlib
 
 from ..utils import SqlConn, load_sql
 
@@ -13,13 +16,40 @@ def attach_sql(connection: SqlConn):
 sql = load_sql(os.path.join(os.path.dirname(__file__), 'script.sql'))
 
 
+def content_hash(body: str) -> str:
+    # Scripts are stored by this, so every script and revision with the same body shares one copy of it
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+# Searches rank at most this many matches, the newest ones, so that a word in nearly every script can't make ranking
+# take longer than the rest of the search
+search_candidates = 1000
+
+# Versions count updates in their low bits. The rest is random for each new script, as ids of deleted scripts can be
+# used again: a new script must not match an ETag of the old one, nor own its jobs.
+version_bits = 24
+
+
+def same_script(version: int, other: int) -> bool:
+    # Whether two versions are of the same script, rather than of two that had the same id
+    return version is not None and other is not None and version >> version_bits == other >> version_bits
+
+
 class Script:
-    def __init__(self, script_id=None, script=None, description=None, fork=None, public_token=None):
+    def __init__(self, script_id=None, script=None, description=None, fork=None, public_token=None, timeout=None,
+                 cacheable=None, cache_ttl=None, coalesce=None, version=None, hash=None, revision=None):
         self.script_id = script_id
         self.script = script
         self.description = description
         self.fork = fork
         self.public_token = public_token
+        self.timeout = timeout
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+        self.coalesce = coalesce
+        self.version = version
+        self.hash = hash
+        self.revision = revision
 
     def _clone(self, other: 'Script'):
         self.script_id = other.script_id
@@ -27,6 +57,13 @@ class Script:
         self.description = other.description
         self.fork = other.fork
         self.public_token = other.public_token
+        self.timeout = other.timeout
+        self.cacheable = other.cacheable
+        self.cache_ttl = other.cache_ttl
+        self.coalesce = other.coalesce
+        self.version = other.version
+        self.hash = other.hash
+        self.revision = other.revision
 
     @staticmethod
     def get(script_id) -> 'Script':
@@ -37,7 +74,25 @@ class Script:
         if not row:
             return None
         else:
-            return Script(script_id=row[0], script=row[1], description=row[2], fork=row[3], public_token=row[4])
+            return Script(script_id=row[0], script=row[1], description=row[2], fork=row[3], public_token=row[4],
+                          timeout=row[5], cacheable=row[6], cache_ttl=row[7], coalesce=row[8], version=row[9],
+                          hash=row[10], revision=row[11])
+
+    @staticmethod
+    def get_version(script_id) -> int:
+        with conn as cur:
+            cur.execute(sql['get_script_version'], (script_id,))
+            row = cur.fetchone()
+
+        return row[0] if row else None
+
+    @staticmethod
+    def get_many(script_ids: list) -> dict:
+        with conn as cur:
+            cur.execute(sql['get_scripts_by_ids'], (json.dumps(script_ids),))
+            rows = cur.fetchall()
+
+        return {row[0]: Script(*row) for row in rows}
 
     @staticmethod
     def get_all() -> ['Script']:
@@ -47,25 +102,141 @@ class Script:
 
         return [Script(*row) for row in rows]
 
+    @staticmethod
+    def get_page(after=0, limit=None, description=None, script_ids=None, with_script=True) -> ['Script']:
+        # Keyset pagination: up to `limit` scripts with an id above `after`, in id order. Optionally only those whose
+        # description contains `description`, or whose id is in `script_ids`. Without `with_script` the script bodies,
+        # the bulk of each row, aren't read at all (and are None).
+        pattern = None
+        if description is not None:
+            pattern = '%{}%'.format(description.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+        if limit is None:
+            limit = -1
+
+        with conn as cur:
+            if script_ids is None:
+                cur.execute(sql['list_scripts'], (after, pattern, with_script, limit))
+            else:
+                cur.execute(sql['list_scripts_by_ids'], (json.dumps(script_ids), after, pattern, with_script, limit))
+            rows = cur.fetchall()
+
+        return [Script(*row) for row in rows]
+
+    @staticmethod
+    def iter_pages(after=0, limit=None, description=None, script_ids=None, with_script=True, batch_size=500):
+        # get_page, a batch at a time (each in its own short transaction), for going through any number of scripts
+        # while holding at most `batch_size` of them
+        remaining = limit
+        while remaining is None or remaining > 0:
+            batch = batch_size if remaining is None else min(batch_size, remaining)
+            scripts = Script.get_page(after, batch, description, script_ids, with_script)
+            yield from scripts
+
+            if len(scripts) < batch:
+                return
+            after = scripts[-1].script_id
+            if remaining is not None:
+                remaining -= len(scripts)
+
+    @staticmethod
+    def _match_query(text: str) -> str:
+        # Every word must appear, as written: each is quoted, so nothing in it is taken as FTS5 syntax. A word ending
+        # in * matches as a prefix.
+        terms = []
+        for word in text.split():
+            prefix = len(word) > 1 and word.endswith('*')
+            if prefix:
+                word = word[:-1]
+            terms.append('"{}"{}'.format(word.replace('"', '""'), '*' if prefix else ''))
+        return ' '.join(terms)
+
+    @staticmethod
+    def search(text: str, limit=20, offset=0, script_ids=None) -> [('Script', float, str)]:
+        # Scripts whose description or body has every word of `text`, best match first, with how well each matched
+        # (lower is better) and a snippet around the match. Only those whose id is in `script_ids`, if given. The
+        # scripts have no body. Snippets are only made for the page returned, in a second scan of the index (looking
+        # up each row on its own is much slower for prefixes).
+        query = Script._match_query(text)
+        if not query or script_ids == []:
+            return []
+
+        with conn as cur:
+            if script_ids is None:
+                cur.execute(sql['search_scripts'], (query, limit, offset, search_candidates))
+            else:
+                cur.execute(sql['search_scripts_by_ids'], (
+                    query, limit, offset, search_candidates, json.dumps(script_ids)))
+            rows = cur.fetchall()
+
+        return [
+            (Script(script_id=row[0], description=row[1], hash=row[2], revision=row[3]), row[4], row[5])
+            for row in rows
+        ]
+
+    @staticmethod
+    def get_ids() -> set:
+        with conn as cur:
+            cur.execute(sql['get_script_ids'])
+            rows = cur.fetchall()
+
+        return {row[0] for row in rows}
+
     def store(self):
+        self.version = int.from_bytes(os.urandom(4), 'big') << version_bits
+        self.hash = content_hash(self.script)
+        self.revision = 1
         with conn as cur:
-            cur.execute(sql['put_script'], (self.script, self.description, self.fork, self.public_token))
+            cur.execute(sql['put_blob'], (self.hash, self.script))
+            cur.execute(sql['put_script'], (
+                self.description, self.fork, self.public_token, self.timeout, self.cacheable, self.cache_ttl,
+                self.coalesce, self.version, self.hash, self.revision,
+            ))
             cur.execute(sql['get_last_id'])
             row = cur.fetchone()
+            cur.execute(sql['put_revision'], (row[0], self.revision, self.hash, time.time()))
+            cur.execute(sql['index_script'], (row[0], self.description, self.script))
 
         self.script_id = row[0]
 
     def update(self):
+        # A new revision only when the body changed. The blob is written first (a no-op if it exists), which also makes
+        # this a write transaction from the start, so reading the current revision can't race another update.
+        body_hash = content_hash(self.script)
         with conn as cur:
-            cur.execute(sql['update_script'], (self.script, self.description, self.fork, self.public_token, self.script_id))
+            cur.execute(sql['put_blob'], (body_hash, self.script))
+            cur.execute(sql['get_script_revision'], (self.script_id,))
+            row = cur.fetchone()
+            if not row:
+                return
+
+            current_hash, revision = row
+            if body_hash != current_hash:
+                revision += 1
+                cur.execute(sql['put_revision'], (self.script_id, revision, body_hash, time.time()))
+            # The search index is told what it had indexed, so that has to be read before the update
+            cur.execute(sql['unindex_script'], (self.script_id,))
+            cur.execute(sql['update_script'], (
+                self.description, self.fork, self.public_token, self.timeout, self.cacheable, self.cache_ttl,
+                self.coalesce, body_hash, revision, self.script_id,
+            ))
+            cur.execute(sql['index_script'], (self.script_id, self.description, self.script))
+
+        self.hash = body_hash
+        self.revision = revision
+        if self.version is not None:
+            self.version += 1
 
     def delete(self):
         with conn as cur:
+            cur.execute(sql['unindex_script'], (self.script_id,))
             cur.execute(sql['delete_script'], (self.script_id,))
 
     def refresh(self):
         self._clone(self.get(self.script_id))
 
+    def etag(self) -> str:
+        return 'script-{}-{}'.format(self.script_id, self.version)
+
     def as_dict(self) -> dict:
         return {
             'script_id': self.script_id,
@@ -73,6 +244,12 @@ class Script:
             'description': self.description,
             'fork': bool(self.fork),
             'public_token': self.public_token,
+            'timeout': self.timeout,
+            'cacheable': bool(self.cacheable),
+            'cache_ttl': self.cache_ttl,
+            'coalesce': bool(self.coalesce),
+            'hash': self.hash,
+            'revision': self.revision,
         }
 
     @staticmethod
@@ -82,6 +259,10 @@ class Script:
             script=data['script'],
             description=data['description'],
             fork=data['fork'],
+            timeout=data.get('timeout', None),
+            cacheable=data.get('cacheable', False),
+            cache_ttl=data.get('cache_ttl', None),
+            coalesce=data.get('coalesce', False),
         )
 
     def update_from_dict(self, data: dict):
@@ -95,3 +276,11 @@ class Script:
             self.fork = data['fork']
         if 'public_token' in data:
             self.public_token = data['public_token']
+        if 'timeout' in data:
+            self.timeout = data['timeout']
+        if 'cacheable' in data:
+            self.cacheable = data['cacheable']
+        if 'cache_ttl' in data:
+            self.cache_ttl = data['cache_ttl']
+        if 'coalesce' in data:
+            self.coalesce = data['coalesce']
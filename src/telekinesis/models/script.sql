@@ -1,17 +1,100 @@
 --@get_script_by_id (script_id)
-SELECT id, script, description, fork, public_token FROM scripts WHERE id = ?;
+SELECT id, (SELECT body FROM blobs WHERE blobs.hash = scripts.hash), description, fork, public_token, timeout,
+  cacheable, cache_ttl, coalesce, version, hash, revision
+FROM scripts WHERE id = ?;
+
+--@get_scripts_by_ids (script_ids_json)
+SELECT id, (SELECT body FROM blobs WHERE blobs.hash = scripts.hash), description, fork, public_token, timeout,
+  cacheable, cache_ttl, coalesce, version, hash, revision
+FROM scripts
+WHERE id IN (SELECT value FROM json_each(?));
 
 --@get_all_scripts
-SELECT id, script, description, fork, public_token FROM scripts;
+SELECT id, (SELECT body FROM blobs WHERE blobs.hash = scripts.hash), description, fork, public_token, timeout,
+  cacheable, cache_ttl, coalesce, version, hash, revision
+FROM scripts;
+
+--@list_scripts (after, description_pattern, with_script, limit)
+SELECT id, CASE WHEN ?3 THEN (SELECT body FROM blobs WHERE blobs.hash = scripts.hash) END, description, fork,
+  public_token, timeout, cacheable, cache_ttl, coalesce, version, hash, revision
+FROM scripts
+WHERE id > ?1 AND (?2 IS NULL OR description LIKE ?2 ESCAPE '\')
+ORDER BY id LIMIT ?4;
+
+--@list_scripts_by_ids (script_ids_json, after, description_pattern, with_script, limit)
+SELECT id, CASE WHEN ?4 THEN (SELECT body FROM blobs WHERE blobs.hash = scripts.hash) END, description, fork,
+  public_token, timeout, cacheable, cache_ttl, coalesce, version, hash, revision
+FROM scripts
+WHERE id IN (SELECT value FROM json_each(?1)) AND id > ?2 AND (?3 IS NULL OR description LIKE ?3 ESCAPE '\')
+ORDER BY id LIMIT ?5;
 
---@put_script (script, description, fork, public_token)
-INSERT INTO scripts (script, description, fork, public_token) VALUES (?, ?, ?, ?);
+--@get_script_ids
+SELECT id FROM scripts;
+
+--@put_blob (hash, body)
+INSERT OR IGNORE INTO blobs (hash, body) VALUES (?, ?);
+
+--@put_script (description, fork, public_token, timeout, cacheable, cache_ttl, coalesce, version, hash, revision)
+INSERT INTO scripts (description, fork, public_token, timeout, cacheable, cache_ttl, coalesce, version, hash, revision)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
 
 --@get_last_id
 SELECT last_insert_rowid();
 
---@update_script (script, description, fork, script_id, public_token)
-UPDATE scripts SET script = ?, description = ?, fork = ?, public_token = ? WHERE id = ?;
+--@update_script (description, fork, public_token, timeout, cacheable, cache_ttl, coalesce, hash, revision, script_id)
+UPDATE scripts SET description = ?, fork = ?, public_token = ?, timeout = ?, cacheable = ?, cache_ttl = ?, coalesce = ?,
+  hash = ?, revision = ?, version = version + 1
+WHERE id = ?;
+
+--@get_script_revision (script_id)
+SELECT hash, revision FROM scripts WHERE id = ?;
+
+--@put_revision (script_id, revision, hash, created)
+INSERT INTO revisions (script_id, revision, hash, created) VALUES (?, ?, ?, ?);
+
+--@index_script (script_id, description, script)
+INSERT INTO scripts_search (rowid, description, script) VALUES (?, ?, ?);
+
+--@unindex_script (script_id)
+INSERT INTO scripts_search (scripts_search, rowid, description, script)
+SELECT 'delete', id, description, script FROM script_texts WHERE id = ?;
+
+--@search_scripts (query, limit, offset, candidates)
+WITH ranked AS MATERIALIZED (
+  SELECT rowid, score FROM (
+    SELECT rowid, rank AS score FROM scripts_search
+    WHERE scripts_search MATCH ?1
+    ORDER BY rowid DESC LIMIT ?4
+  ) ORDER BY score LIMIT ?2 OFFSET ?3
+)
+SELECT scripts.id, scripts.description, scripts.hash, scripts.revision, ranked.score,
+  snippet(scripts_search, -1, '**', '**', '...', 16)
+FROM scripts_search
+CROSS JOIN ranked ON ranked.rowid = scripts_search.rowid
+CROSS JOIN scripts ON scripts.id = scripts_search.rowid
+WHERE scripts_search MATCH ?1
+  AND scripts_search.rowid BETWEEN (SELECT min(rowid) FROM ranked) AND (SELECT max(rowid) FROM ranked)
+ORDER BY ranked.score;
+
+--@search_scripts_by_ids (query, limit, offset, candidates, script_ids_json)
+WITH ranked AS MATERIALIZED (
+  SELECT rowid, score FROM (
+    SELECT rowid, rank AS score FROM scripts_search
+    WHERE scripts_search MATCH ?1 AND +rowid IN (SELECT value FROM json_each(?5))
+    ORDER BY rowid DESC LIMIT ?4
+  ) ORDER BY score LIMIT ?2 OFFSET ?3
+)
+SELECT scripts.id, scripts.description, scripts.hash, scripts.revision, ranked.score,
+  snippet(scripts_search, -1, '**', '**', '...', 16)
+FROM scripts_search
+CROSS JOIN ranked ON ranked.rowid = scripts_search.rowid
+CROSS JOIN scripts ON scripts.id = scripts_search.rowid
+WHERE scripts_search MATCH ?1
+  AND scripts_search.rowid BETWEEN (SELECT min(rowid) FROM ranked) AND (SELECT max(rowid) FROM ranked)
+ORDER BY ranked.score;
+
+--@get_script_version (script_id)
+SELECT version FROM scripts WHERE id = ?;
 
 --@delete_script (script_id)
 DELETE FROM scripts WHERE id = ?;
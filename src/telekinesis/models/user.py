@@ -12,7 +12,7 @@ def attach_auth(authorization: Gatekeeper):
 
 
 class User:
-    def __init__(self, username=None, password=None, permissions=None):
+    def __init__(self, username=None, password=None, permissions=None, roles=None):
         self.username = username
         self.password = password
 
@@ -21,19 +21,26 @@ class User:
         else:
             self.permissions = permissions
 
+        if roles is None:
+            self.roles = []
+        else:
+            self.roles = roles
+
     def _clone(self, other: 'User'):
         self.username = other.username
         self.password = other.password
         self.permissions = deepcopy(other.permissions)
+        self.roles = deepcopy(other.roles)
 
     @staticmethod
     def get(username) -> 'User':
         try:
             permissions = auth.get_permissions(username)
+            roles = auth.get_roles(username)
         except GatekeeperException:
             return None
 
-        return User(username=username, permissions=permissions)
+        return User(username=username, permissions=permissions, roles=roles)
 
     def get_session(self, expiry=None):
         if expiry is None:
@@ -57,10 +64,17 @@ class User:
     def remove_permission(self, permission: str):
         auth.remove_permission(user=self.username, permission=permission)
 
+    def add_role(self, role: str):
+        auth.add_role(user=self.username, role=role)
+
+    def remove_role(self, role: str):
+        auth.remove_role(user=self.username, role=role)
+
     def as_dict(self) -> dict:
         return {
             'username': self.username,
             'permissions': self.permissions,
+            'roles': self.roles,
         }
 
     @staticmethod
@@ -11,12 +11,23 @@ from .methods import \
     script_update, \
     script_destroy, \
     script_execute, \
+    script_revisions, \
+    script_revision_read, \
+    script_revision_execute, \
+    script_diff, \
+    job_read, \
+    job_read_pid, \
+    job_output, \
     scripts_read, \
+    scripts_search, \
+    scripts_execute, \
     user_create, \
     user_read, \
     user_delete, \
     permission_create, \
     permission_delete, \
+    role_create, \
+    role_delete, \
     login, \
     directory
 
@@ -95,6 +106,49 @@ def route_script_id_token(script_id, token):
         }.get(request.method)(script_id=script_id)
 
 
+@app.route('/script/<int:script_id>/revisions', methods=['GET', 'OPTIONS'])
+def route_script_id_revisions(script_id):
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': script_revisions,
+        }.get(request.method)(script_id=script_id)
+
+
+@app.route('/script/<int:script_id>/revisions/<int:revision>', methods=['GET', 'POST', 'OPTIONS'])
+def route_script_id_revision(script_id, revision):
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, POST, OPTIONS'}
+    else:
+        return {
+            'GET': script_revision_read,
+            'POST': script_revision_execute,
+        }.get(request.method)(script_id=script_id, revision=revision)
+
+
+@app.route('/script/<int:script_id>/revisions/<int:revision>/<string:token>', methods=['GET', 'POST', 'OPTIONS'])
+def route_script_id_revision_token(script_id, revision, token):
+    request.token = token
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, POST, OPTIONS'}
+    else:
+        return {
+            'GET': script_revision_read,
+            'POST': script_revision_execute,
+        }.get(request.method)(script_id=script_id, revision=revision)
+
+
+@app.route('/script/<int:script_id>/diff', methods=['GET', 'OPTIONS'])
+def route_script_id_diff(script_id):
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': script_diff,
+        }.get(request.method)(script_id=script_id)
+
+
 @app.route('/scripts', methods=['GET', 'OPTIONS'])
 def route_scripts():
     if request.method == 'OPTIONS':
@@ -105,6 +159,91 @@ def route_scripts():
         }.get(request.method)()
 
 
+@app.route('/scripts/search', methods=['GET', 'OPTIONS'])
+def route_scripts_search():
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': scripts_search,
+        }.get(request.method)()
+
+
+@app.route('/scripts/execute', methods=['POST', 'OPTIONS'])
+def route_scripts_execute():
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'POST, OPTIONS'}
+    else:
+        return {
+            'POST': scripts_execute,
+        }.get(request.method)()
+
+
+@app.route('/job/<int:job_id>', methods=['GET', 'OPTIONS'])
+def route_job_id(job_id):
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': job_read,
+        }.get(request.method)(job_id=job_id)
+
+
+@app.route('/job/<int:job_id>/<string:token>', methods=['GET', 'OPTIONS'])
+def route_job_id_token(job_id, token):
+    request.token = token
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': job_read,
+        }.get(request.method)(job_id=job_id)
+
+
+@app.route('/job/pid/<int:pid>', methods=['GET', 'OPTIONS'])
+def route_job_pid(pid):
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': job_read_pid,
+        }.get(request.method)(pid=pid)
+
+
+@app.route('/job/pid/<int:pid>/<string:token>', methods=['GET', 'OPTIONS'])
+def route_job_pid_token(pid, token):
+    request.token = token
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': job_read_pid,
+        }.get(request.method)(pid=pid)
+
+
+@app.route('/job/<int:job_id>/stdout', methods=['GET', 'OPTIONS'], defaults={'stream': 'stdout'})
+@app.route('/job/<int:job_id>/stderr', methods=['GET', 'OPTIONS'], defaults={'stream': 'stderr'})
+def route_job_id_output(job_id, stream):
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': job_output,
+        }.get(request.method)(job_id=job_id, stream=stream)
+
+
+@app.route('/job/<int:job_id>/stdout/<string:token>', methods=['GET', 'OPTIONS'], defaults={'stream': 'stdout'})
+@app.route('/job/<int:job_id>/stderr/<string:token>', methods=['GET', 'OPTIONS'], defaults={'stream': 'stderr'})
+def route_job_id_output_token(job_id, stream, token):
+    request.token = token
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'GET, OPTIONS'}
+    else:
+        return {
+            'GET': job_output,
+        }.get(request.method)(job_id=job_id, stream=stream)
+
+
 @app.route('/user', methods=['PUT', 'OPTIONS'])
 def route_user():
     if request.method == 'OPTIONS':
@@ -137,6 +276,17 @@ def route_permission():
         }.get(request.method)()
 
 
+@app.route('/role', methods=['PUT', 'DELETE', 'OPTIONS'])
+def route_role():
+    if request.method == 'OPTIONS':
+        return '', 200, {'Access-Control-Allow-Methods': 'PUT, DELETE, OPTIONS'}
+    else:
+        return {
+            'PUT': role_create,
+            'DELETE': role_delete,
+        }.get(request.method)()
+
+
 @app.route('/login', methods=['POST'])
 def route_login():
     return login()
@@ -0,0 +1,85 @@
+import subprocess
+import threading
+import hashlib
+import logging
+import time
+import os
+
+
+class SshPool:
+    # Keeps one multiplexed (ControlMaster) connection per target, so that each execution opens a new channel on an
+    # already-authenticated connection rather than paying for TCP setup, key exchange and auth every time.
+    # The master is started by the first execution and exits on its own after `persist` idle seconds.
+    def __init__(self, ssh_args: list, control_dir: str, persist: int = 300, check_interval: int = 30,
+                 ssh_command: str = 'ssh'):
+        self.ssh_args = ssh_args
+        self.persist = persist
+        self.check_interval = check_interval
+        self.ssh_command = ssh_command
+
+        target = hashlib.sha1(' '.join(ssh_args).encode('utf-8')).hexdigest()[:16]
+        self.control_path = os.path.join(control_dir, 'ssh-{}'.format(target))
+        if len(self.control_path) > 100:
+            # Unix socket paths are capped at ~108 bytes
+            logging.warning('SSH control path {} is too long, falling back to /tmp'.format(self.control_path))
+            self.control_path = os.path.join('/tmp', 'telekinesis-{}-ssh-{}'.format(os.getuid(), target))
+
+        self._lock = threading.Lock()
+        self._last_check = 0
+
+    def _control_opts(self) -> list:
+        return ['-o', 'ControlPath={}'.format(self.control_path)]
+
+    def command(self) -> list:
+        if self.persist <= 0:
+            return [self.ssh_command, '-T'] + self.ssh_args
+
+        self._health_check()
+        return [self.ssh_command, '-T'] + self._control_opts() + [
+            '-o', 'ControlMaster=auto',
+            '-o', 'ControlPersist={}'.format(self.persist),
+        ] + self.ssh_args
+
+    def check(self) -> bool:
+        res = subprocess.run(
+            args=[self.ssh_command, '-O', 'check'] + self._control_opts() + self.ssh_args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=5,
+        )
+        return res.returncode == 0
+
+    def close(self):
+        subprocess.run(
+            args=[self.ssh_command, '-O', 'exit'] + self._control_opts() + self.ssh_args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=5,
+        )
+        if os.path.exists(self.control_path):
+            os.remove(self.control_path)
+
+    def _health_check(self):
+        with self._lock:
+            if time.monotonic() - self._last_check < self.check_interval:
+                return
+            self._last_check = time.monotonic()
+
+            # No socket means the master is idle-evicted or not started yet; the next execution will start one
+            if not os.path.exists(self.control_path):
+                return
+
+            try:
+                healthy = self.check()
+            except subprocess.TimeoutExpired:
+                healthy = False
+
+            if not healthy:
+                # A socket left behind by a dead master makes ssh silently fall back to a full connection each time
+                logging.warning('SSH master at {} is not responding, discarding it'.format(self.control_path))
+                try:
+                    self.close()
+                except (OSError, subprocess.TimeoutExpired) as err:
+                    logging.error('Could not remove stale SSH master: {}'.format(err))
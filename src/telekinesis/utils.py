@@ -1,4 +1,10 @@
 import sqlite3
+import threading
+import logging
+import base64
+import fcntl
+import time
+import os
 
 
 def load_sql(fname):
@@ -22,22 +28,242 @@ def load_sql(fname):
     return res
 
 
+def encode_output(data: bytes, partial: bool = False):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as err:
+        # Output cut off at a size limit may end partway through a character; that alone shouldn't force base64
+        if partial and err.reason == 'unexpected end of data' and err.start > len(data) - 4:
+            return encode_output(data[:err.start])
+        return {
+            'data': base64.b64encode(data).decode('utf-8'),
+            'format': 'base64'
+        }
+
+
+_journal_modes = {'wal', 'delete', 'truncate', 'persist', 'memory'}
+_synchronous_levels = {'off', 'normal', 'full', 'extra'}
+_read_statements = {'SELECT', 'PRAGMA', 'WITH', 'EXPLAIN'}
+
+
+def _is_busy(err: sqlite3.OperationalError) -> bool:
+    return 'locked' in str(err) or 'busy' in str(err)
+
+
+class _Cursor(sqlite3.Cursor):
+    # Lets SqlConn see the first statement of a transaction before it runs
+    sql_conn = None
+
+    def execute(self, statement, parameters=()):
+        self.sql_conn._begin(statement)
+        return super().execute(statement, parameters)
+
+    def executemany(self, statement, seq_of_parameters):
+        self.sql_conn._begin(statement)
+        return super().executemany(statement, seq_of_parameters)
+
+
 class SqlConn:
-    def __init__(self, db_location):
+    # Each thread keeps one connection to the database open and reuses it, rather than connecting for every query.
+    # Pragmas are applied once per connection. The outermost `with` is a transaction, and nested ones are savepoints
+    # within it, so a failure rolls back only the inner block.
+    #
+    # The transaction starts with the first statement: if that is a write, the write lock is taken up front
+    # (BEGIN IMMEDIATE), which waits out other writers instead of failing partway through. With `single_writer`, writers
+    # also queue on a lock file first, so they take turns rather than all polling the database.
+    def __init__(self, db_location, journal_mode='wal', synchronous='normal', busy_timeout=5000, busy_retries=5,
+                 single_writer=False, cached_statements=256):
+        if str(journal_mode).lower() not in _journal_modes:
+            raise ValueError('Unknown journal mode {}'.format(journal_mode))
+        if str(synchronous).lower() not in _synchronous_levels:
+            raise ValueError('Unknown synchronous level {}'.format(synchronous))
+
         self.db_location = db_location
+        self.journal_mode = str(journal_mode).lower()
+        self.synchronous = str(synchronous).lower()
+        self.busy_timeout = int(busy_timeout)
+        self.busy_retries = int(busy_retries)
+        self.single_writer = single_writer
+        self.cached_statements = cached_statements
+        # Jobs finish on background threads, and sqlite connections can't be shared between threads
+        self._local = threading.local()
+
+    def _retry(self, operation):
+        # By the time sqlite reports the database as locked, it has already waited busy_timeout for it
+        delay = 0.05
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return operation()
+            except sqlite3.OperationalError as err:
+                if not _is_busy(err) or attempt == self.busy_retries:
+                    raise
+                logging.warning('Database {} is busy, retrying: {}'.format(self.db_location, err))
+                time.sleep(delay)
+                delay *= 2
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_location, timeout=self.busy_timeout / 1000, isolation_level=None,
+                               cached_statements=self.cached_statements)
+        conn.execute('PRAGMA foreign_keys = ON;')
+        if conn.execute('PRAGMA journal_mode;').fetchone()[0] != self.journal_mode:
+            self._retry(lambda: conn.execute('PRAGMA journal_mode = {};'.format(self.journal_mode)))
+        conn.execute('PRAGMA synchronous = {};'.format(self.synchronous))
+        return conn
+
+    def _state(self):
+        local = self._local
+        # A connection must never be used on both sides of a fork; a forked worker opens its own
+        if getattr(local, 'pid', None) != os.getpid():
+            local.pid = os.getpid()
+            local.conn = None
+            local.depth = 0
+            local.began = False
+            local.savepoints = []
+            local.callbacks = []
+            local.writer_fd = None
+        if local.conn is None:
+            local.conn = self._connect()
+        return local
+
+    def _lock_writer(self, local):
+        local.writer_fd = os.open(self.db_location + '.writer', os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(local.writer_fd, fcntl.LOCK_EX)
+
+    def _unlock_writer(self, local):
+        if local.writer_fd is not None:
+            fd, local.writer_fd = local.writer_fd, None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _begin(self, statement: str):
+        local = self._local
+        if not local.began:
+            words = statement.split(None, 1)
+            if words and words[0].upper() in _read_statements:
+                local.conn.execute('BEGIN;')
+            else:
+                if self.single_writer:
+                    self._lock_writer(local)
+                try:
+                    self._retry(lambda: local.conn.execute('BEGIN IMMEDIATE;'))
+                except Exception:
+                    self._unlock_writer(local)
+                    raise
+            local.began = True
+
+        # Savepoints for nested blocks that were entered before anything ran
+        for depth, issued in enumerate(local.savepoints, start=1):
+            if not issued:
+                local.conn.execute('SAVEPOINT nested_{};'.format(depth))
+                local.savepoints[depth - 1] = True
 
     def __enter__(self) -> sqlite3.Cursor:
-        self.conn = sqlite3.connect(self.db_location)
-        self.cur = self.conn.cursor()
-        self.cur.execute('PRAGMA foreign_keys = ON;')
-        return self.cur
+        local = self._state()
+        if local.depth > 0:
+            if local.began:
+                local.conn.execute('SAVEPOINT nested_{};'.format(local.depth))
+            local.savepoints.append(local.began)
+        local.depth += 1
+
+        cur = local.conn.cursor(factory=_Cursor)
+        cur.sql_conn = self
+        return cur
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_tb is not None:
-            self.cur.close()
-            self.conn.close()
-            return False
-
-        self.cur.close()
-        self.conn.commit()
-        self.conn.close()
+        local = self._local
+        local.depth -= 1
+
+        try:
+            if local.depth == 0:
+                if local.began:
+                    local.began = False
+                    if exc_tb is None:
+                        self._retry(lambda: local.conn.execute('COMMIT;'))
+                    else:
+                        local.conn.execute('ROLLBACK;')
+            elif local.savepoints.pop():
+                if exc_tb is not None:
+                    local.conn.execute('ROLLBACK TO nested_{};'.format(local.depth))
+                local.conn.execute('RELEASE nested_{};'.format(local.depth))
+        except sqlite3.Error:
+            # e.g. sqlite already rolled back on its own; start over with a fresh connection rather than trust this one
+            if local.depth == 0:
+                self._discard(local)
+            if exc_tb is None:
+                raise
+        finally:
+            if local.depth == 0:
+                self._unlock_writer(local)
+                callbacks, local.callbacks = local.callbacks, []
+                for callback in callbacks:
+                    callback()
+
+        return False
+
+    def _discard(self, local):
+        try:
+            local.conn.close()
+        except sqlite3.Error:
+            pass
+        local.conn = None
+        local.began = False
+        local.savepoints = []
+
+    def autocommit(self, statement: str, parameters=()) -> list:
+        # Runs a statement outside of any transaction, for the few that refuse to run inside one (e.g. VACUUM, ATTACH)
+        local = self._state()
+        if local.depth > 0:
+            raise sqlite3.ProgrammingError('Cannot run {} inside a transaction'.format(statement))
+        return self._retry(lambda: local.conn.execute(statement, parameters).fetchall())
+
+    def after_transaction(self, callback):
+        # Runs `callback` once the current outermost transaction has ended (committed or not), or right away if there
+        # is none. For anything that has to wait until other processes can see the changes, e.g. cache invalidation.
+        local = self._state()
+        if local.depth == 0:
+            callback()
+        else:
+            local.callbacks.append(callback)
+
+    def close(self):
+        # Closes this thread's connection, e.g. before forking workers. The next `with` opens a new one.
+        local = self._local
+        if getattr(local, 'pid', None) == os.getpid() and local.conn is not None and local.depth == 0:
+            local.conn.close()
+            local.conn = None
+
+
+def migrate(conn: SqlConn, migrations: list, component: str, legacy_component: str = None) -> int:
+    # Brings a database's schema up to date. Migrations are functions taking a cursor, applied in order, each in its
+    # own transaction. How many have been applied is recorded per component, so that several components can share a
+    # database file and each migration runs exactly once. Never edit or reorder a released migration -- add a new one.
+    # `legacy_component` is the one component the file held before components were tracked by name, if any.
+    lock_fd = os.open(conn.db_location + '.migrate', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        # Several processes may start up against the same database at once
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+
+        with conn as cur:
+            cur.execute('CREATE TABLE IF NOT EXISTS schema_versions (component TEXT PRIMARY KEY, version INTEGER);')
+            cur.execute('SELECT version FROM schema_versions WHERE component = ?;', (component,))
+            row = cur.fetchone()
+            if row is None and component == legacy_component:
+                # Databases from before components were tracked by name kept their only component's version here
+                cur.execute('PRAGMA user_version;')
+                row = cur.fetchone()
+            elif row is None:
+                # New to this file, e.g. the security tables moving into a shared database
+                row = (0,)
+        version = row[0]
+
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            logging.info('Migrating {} of {} to schema version {}'.format(component, conn.db_location, number))
+            with conn as cur:
+                migration(cur)
+                cur.execute('INSERT OR REPLACE INTO schema_versions (component, version) VALUES (?, ?);',
+                            (component, number))
+
+        return len(migrations)
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
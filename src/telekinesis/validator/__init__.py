@@ -1,5 +1,7 @@
-from .script import script_create, script_read, script_update, script_delete, script_execute
+from .script import script_create, script_read, script_update, script_delete, script_execute, scripts_execute, \
+    scripts_read, scripts_search, script_revisions, script_revision_read, script_revision_execute, script_diff
 from .user import user_create, user_read, user_delete, user_login
-from .permission import permission_create, permission_delete
+from .permission import permission_create, permission_delete, role_create, role_delete
+from .job import job_read, job_read_pid, job_output
 
 from .wrapper import validated_by, authorized_by, attach_authorizer
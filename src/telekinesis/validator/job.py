@@ -0,0 +1,36 @@
+from .utils import required
+
+_job_id = {
+    'type': 'integer',
+    'min': 0,
+    'required': False,
+}
+_job_id_required = required(_job_id)
+
+_pid = {
+    'type': 'integer',
+    'min': 1,
+    'required': False,
+}
+_pid_required = required(_pid)
+
+_stream = {
+    'type': 'string',
+    'allowed': ['stdout', 'stderr'],
+    'required': False,
+}
+_stream_required = required(_stream)
+
+
+job_read = {
+    'job_id': _job_id_required,
+}
+
+job_read_pid = {
+    'pid': _pid_required,
+}
+
+job_output = {
+    'job_id': _job_id_required,
+    'stream': _stream_required,
+}
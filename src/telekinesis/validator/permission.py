@@ -12,9 +12,27 @@ _username_required_allow_public = deepcopy(_username_required)
 del _username_required_allow_public['validator']
 
 
+def valid_permission_pattern(field, value, error):
+    # "*", "script.*", "script.execute.*" etc.: everything under a prefix of the valid permissions below
+    units = value.split('.')
+
+    if units == ['*']:
+        return
+
+    if units[0] == 'script' and len(units) == 3 and units[1] in {'read', 'update', 'destroy', 'execute'}:
+        return
+
+    if not (len(units) == 2 and units[0] in {'script', 'scripts', 'user', 'permission'}):
+        error(field, "Invalid permission pattern")
+
+
 def valid_permission(field, value, error):
     if not isinstance(value, str):
         error(field, "Must be type \"string\"")
+        return
+
+    if value == '*' or value.endswith('.*'):
+        return valid_permission_pattern(field, value, error)
 
     if value in {
         Permissions.script.create,
@@ -27,13 +45,11 @@ def valid_permission(field, value, error):
     }:
         return
 
-    if not value.startswith("script."):
-        error(field, "Invalid permission")
-
     units = value.split('.')
 
-    if not len(units) == 3:
+    if not (units[0] == 'script' and len(units) == 3):
         error(field, "Invalid permission")
+        return
 
     if not units[1] in {
         "read",
@@ -43,7 +59,8 @@ def valid_permission(field, value, error):
     }:
         error(field, "Invalid permission")
 
-    if not len(units[2]) > 0:
+    # "*" only means anything as a whole last unit (see valid_permission_pattern)
+    if not len(units[2]) > 0 or '*' in units[2]:
         error(field, "Invalid permission")
 
 
@@ -65,3 +82,13 @@ permission_delete = {
     'username': _username_required_allow_public,
     'permission': _permission_required,
 }
+
+role_create = {
+    'username': _username_required,
+    'role': _username_required,
+}
+
+role_delete = {
+    'username': _username_required_allow_public,
+    'role': _username_required,
+}
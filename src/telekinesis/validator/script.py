@@ -1,4 +1,4 @@
-from .utils import required, coerce_bool
+from .utils import required, coerce_bool, coerce_list
 
 _script_id = {
     'type': 'integer',
@@ -30,11 +30,141 @@ _fork = {
 }
 _fork_required = required(_fork)
 
+_timeout = {
+    'type': 'integer',
+    'min': 1,
+    'max': 86400,
+    'nullable': True,
+    'required': False,
+}
+
+_cacheable = {
+    'type': 'boolean',
+    'coerce': coerce_bool,
+    'required': False,
+}
+
+_cache_ttl = {
+    'type': 'integer',
+    'min': 1,
+    'max': 86400,
+    'nullable': True,
+    'required': False,
+}
+
+_coalesce = {
+    'type': 'boolean',
+    'coerce': coerce_bool,
+    'required': False,
+}
+
+_script_ids = {
+    'type': 'list',
+    'minlength': 1,
+    'maxlength': 100,
+    'schema': _script_id_required,
+    'required': False,
+}
+_script_ids_required = required(_script_ids)
+
+_parallelism = {
+    'type': 'integer',
+    'min': 1,
+    'max': 32,
+    'default': 8,
+    'required': False,
+}
+
+_stream = {
+    'type': 'boolean',
+    'coerce': coerce_bool,
+    'default': False,
+    'required': False,
+}
+
+_mode = {
+    'type': 'string',
+    'allowed': ['sync', 'async', 'stream'],
+    'default': 'sync',
+    'required': False,
+}
+
+_after = {
+    'type': 'integer',
+    'coerce': int,
+    'min': 0,
+    'default': 0,
+    'required': False,
+}
+
+_limit = {
+    'type': 'integer',
+    'coerce': int,
+    'min': 1,
+    'max': 1000,
+    'required': False,
+}
+
+_q = {
+    'type': 'string',
+    'minlength': 1,
+    'maxlength': 10000,
+    'required': False,
+}
+
+_q_required = required(_q)
+
+_search_limit = {
+    'type': 'integer',
+    'coerce': int,
+    'min': 1,
+    'max': 100,
+    'default': 20,
+    'required': False,
+}
+
+_offset = {
+    'type': 'integer',
+    'coerce': int,
+    'min': 0,
+    'max': 1000,
+    'default': 0,
+    'required': False,
+}
+
+_accessible = {
+    'type': 'boolean',
+    'coerce': coerce_bool,
+    'default': False,
+    'required': False,
+}
+
+_revision = {
+    'type': 'integer',
+    'coerce': int,
+    'min': 1,
+    'required': False,
+}
+_revision_required = required(_revision)
+
+_fields = {
+    'type': 'list',
+    'coerce': coerce_list,
+    'minlength': 1,
+    'allowed': ['script_id', 'script', 'description', 'fork', 'public_token', 'timeout', 'cacheable', 'cache_ttl',
+                'coalesce', 'hash', 'revision'],
+    'required': False,
+}
+
 
 script_create = {
     'script': _script_required,
     'description': _description_required,
     'fork': _fork_required,
+    'timeout': _timeout,
+    'cacheable': _cacheable,
+    'cache_ttl': _cache_ttl,
+    'coalesce': _coalesce,
 }
 
 script_read = {
@@ -46,6 +176,10 @@ script_update = {
     'script': _script,
     'description': _description,
     'fork': _fork,
+    'timeout': _timeout,
+    'cacheable': _cacheable,
+    'cache_ttl': _cache_ttl,
+    'coalesce': _coalesce,
 }
 
 script_delete = {
@@ -54,4 +188,47 @@ script_delete = {
 
 script_execute = {
     'script_id': _script_id_required,
+    'mode': _mode,
+}
+
+script_revisions = {
+    'script_id': _script_id_required,
+}
+
+script_revision_read = {
+    'script_id': _script_id_required,
+    'revision': _revision_required,
+}
+
+script_revision_execute = {
+    'script_id': _script_id_required,
+    'revision': _revision_required,
+    'mode': _mode,
+}
+
+script_diff = {
+    'script_id': _script_id_required,
+    'from': _revision,
+    'to': _revision,
+}
+
+scripts_execute = {
+    'script_ids': _script_ids_required,
+    'parallelism': _parallelism,
+    'stream': _stream,
+}
+
+scripts_read = {
+    'after': _after,
+    'limit': _limit,
+    'q': _q,
+    'accessible': _accessible,
+    'fields': _fields,
+    'stream': _stream,
+}
+
+scripts_search = {
+    'q': _q_required,
+    'limit': _search_limit,
+    'offset': _offset,
 }
@@ -7,6 +7,13 @@ def required(elem: dict) -> dict:
     return d
 
 
+def coerce_list(s):
+    # Query args carry lists as comma separated strings
+    if isinstance(s, str):
+        return [item for item in s.split(',') if item]
+    return s
+
+
 def coerce_bool(b):
     if isinstance(b, str):
         return b.lower() in {'true', 't', '1', 'yes', 'y'}
@@ -6,9 +6,11 @@ from flask import request, jsonify
 import cerberus
 
 
-def validated_by(schema, pathargs=None):
+def validated_by(schema, pathargs=None, queryargs=None):
     if pathargs is None:
         pathargs = []
+    if queryargs is None:
+        queryargs = []
 
     def annotator(f):
         @wraps(f)
@@ -20,6 +22,9 @@ def validated_by(schema, pathargs=None):
                 data = {}
             for arg in pathargs:
                 data[arg] = kwargs[arg]
+            for arg in queryargs:
+                if arg in request.args:
+                    data[arg] = request.args[arg]
 
             v = cerberus.Validator()
             if not v.validate(data, schema):
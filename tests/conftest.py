@@ -0,0 +1,21 @@
+import sys
+import os
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from telekinesis import Telekinesis, initialize  # noqa: E402
+
+
+security = {'security_type': 'none', 'ssh_args': '', 'username': '', 'password': ''}
+
+
+@pytest.fixture
+def client(tmp_path):
+    initialize('admin', 'pw', str(tmp_path), security)
+    client = Telekinesis.test_client()
+    resp = client.post('/login', data=json.dumps({'username': 'admin', 'password': 'pw'}))
+    client.set_cookie('session', resp.get_json()['session'])
+    return client
@@ -0,0 +1,68 @@
+import json
+import time
+import os
+import threading
+
+from telekinesis import capture
+from telekinesis.models import Job
+
+
+def run_async(client, script_id: int) -> dict:
+    job = client.post('/script/{}'.format(script_id), data=json.dumps({'mode': 'async'})).get_json()
+    for _ in range(100):
+        job = client.get('/job/{}'.format(job['job_id'])).get_json()
+        if job['status'] != 'running':
+            return job
+        time.sleep(0.05)
+    raise AssertionError('job {} did not finish'.format(job['job_id']))
+
+
+def create(client, body: str) -> dict:
+    return client.put('/script', data=json.dumps({'script': body, 'description': 'jobs', 'fork': False})).get_json()
+
+
+def test_jobs_survive_updates(client):
+    script = create(client, 'echo one')
+    job = run_async(client, script['script_id'])
+    client.patch('/script/{}'.format(script['script_id']), data=json.dumps({'script': 'echo two'}))
+
+    resp = client.get('/job/{}'.format(job['job_id']))
+    assert resp.status_code == 200
+    assert resp.get_json()['stdout'] == 'one\n'
+
+
+def test_jobs_go_with_their_script(client):
+    script = create(client, 'echo secret')
+    job = run_async(client, script['script_id'])
+    assert client.delete('/script/{}'.format(script['script_id'])).status_code == 200
+
+    # The next script gets the deleted one's id, but none of its jobs
+    assert create(client, 'echo hi')['script_id'] == script['script_id']
+    assert client.get('/job/{}'.format(job['job_id'])).status_code == 401
+    assert client.get('/job/{}/stdout'.format(job['job_id'])).status_code == 401
+
+
+def test_spilled_output_goes_with_its_script(client, monkeypatch):
+    monkeypatch.setitem(capture.limits, 'limit', 100)
+    script = create(client, 'head -c 1000 /dev/zero')
+    res = client.post('/script/{}'.format(script['script_id'])).get_json()
+    assert res['truncated']
+
+    job = Job.get(res['job_id'])
+    assert os.path.isfile(job.stdout_path)
+    assert client.delete('/script/{}'.format(script['script_id'])).status_code == 200
+    assert not os.path.exists(job.stdout_path)
+
+
+def test_output_of_jobs_deleted_while_running_is_removed(client, monkeypatch):
+    monkeypatch.setitem(capture.limits, 'limit', 100)
+    script = create(client, 'sleep 0.5; head -c 1000 /dev/zero')
+    job = client.post('/script/{}'.format(script['script_id']), data=json.dumps({'mode': 'async'})).get_json()
+    assert client.delete('/script/{}'.format(script['script_id'])).status_code == 200
+
+    # Wait for the thread finishing the job
+    for thread in threading.enumerate():
+        if thread.name.endswith('(_finish_job)'):
+            thread.join(5)
+    assert Job.get(job['job_id']) is None
+    assert os.listdir(capture.limits['spill_dir']) == []
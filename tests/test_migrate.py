@@ -0,0 +1,46 @@
+import importlib
+import sqlite3
+import json
+import os
+
+from telekinesis import Telekinesis, initialize
+from telekinesis import models
+
+# The package exports the class under the module's name
+gatekeeper_module = importlib.import_module('telekinesis.Gatekeeper.Gatekeeper')
+
+
+security = {'security_type': 'none', 'ssh_args': '', 'username': '', 'password': ''}
+
+
+def make_legacy_db(path: str, migrations: list):
+    # A database as left by releases that recorded the schema version in PRAGMA user_version
+    db = sqlite3.connect(path)
+    cur = db.cursor()
+    for migration in migrations:
+        migration(cur)
+    cur.execute('PRAGMA user_version = {};'.format(len(migrations)))
+    db.commit()
+    db.close()
+
+
+def test_unified_storage_upgrades_separate_databases(tmp_path):
+    data_dir = str(tmp_path)
+    make_legacy_db(os.path.join(data_dir, 'security.db'), gatekeeper_module._migrations[:2])
+    make_legacy_db(os.path.join(data_dir, 'telekinesis.db'), models._migrations[:3])
+
+    db = sqlite3.connect(os.path.join(data_dir, 'telekinesis.db'))
+    db.execute("INSERT INTO scripts (script, description, fork) VALUES ('echo old', 'from before', 0);")
+    db.commit()
+    db.close()
+
+    initialize('admin', 'pw', data_dir, security, unified_storage=True)
+
+    assert os.path.isfile(os.path.join(data_dir, 'security.db.merged'))
+    client = Telekinesis.test_client()
+    resp = client.post('/login', data=json.dumps({'username': 'admin', 'password': 'pw'}))
+    assert resp.status_code == 200
+    client.set_cookie('session', resp.get_json()['session'])
+
+    scripts = client.get('/scripts').get_json()
+    assert [(script['script'], script['revision']) for script in scripts] == [('echo old', 1)]
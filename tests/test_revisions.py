@@ -0,0 +1,33 @@
+import json
+
+
+def test_diff_marks_missing_newline(client):
+    script = client.put('/script', data=json.dumps({
+        'script': 'echo hi\necho disk usage', 'description': 'diff', 'fork': False,
+    })).get_json()
+    client.patch('/script/{}'.format(script['script_id']), data=json.dumps({'script': 'echo hi\necho bye'}))
+
+    resp = client.get('/script/{}/diff'.format(script['script_id']))
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True).splitlines()[2:] == [
+        '@@ -1,2 +1,2 @@',
+        ' echo hi',
+        '-echo disk usage',
+        '\\ No newline at end of file',
+        '+echo bye',
+        '\\ No newline at end of file',
+    ]
+
+
+def test_public_token_runs_a_revision(client):
+    script = client.put('/script', data=json.dumps({'script': 'echo one', 'description': 'pinned', 'fork': False}))
+    script = script.get_json()
+    client.patch('/script/{}'.format(script['script_id']), data=json.dumps({'script': 'echo two'}))
+
+    anonymous = client.application.test_client()
+    url = '/script/{}/revisions/1/{}'.format(script['script_id'], script['public_token'])
+    assert anonymous.get(url).get_json()['script'] == 'echo one'
+    resp = anonymous.post(url)
+    assert resp.status_code == 200
+    assert resp.get_json()['stdout'] == 'one\n'
+    assert anonymous.post('/script/{}/revisions/1/wrong'.format(script['script_id'])).status_code == 401